@@ -0,0 +1,149 @@
+"""
+Log de acesso estruturado e não bloqueante para a API Segura
+Uma linha JSON por requisição, serializada e escrita por uma thread em
+segundo plano, com amostragem por status
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional, TextIO
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Converte "5xx=1,4xx=1,2xx=0.01,404=0.1" em {"5xx": 1.0, ...}
+    Chaves podem ser um status exato ou uma classe (2xx, 3xx, 4xx, 5xx)
+    """
+    rates = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        key, _, value = part.partition("=")
+        rates[key.strip().lower()] = float(value)
+    return rates
+
+
+class AccessLogger:
+    """
+    Log de acesso com fila e thread de escrita
+
+    log() só decide a amostragem e enfileira uma tupla; a serialização em
+    JSON e a escrita acontecem na thread, em lotes de até `batch_size`
+    linhas com um flush por lote. Com a fila cheia o registro é descartado
+    e contado em `dropped`, em vez de segurar a requisição.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        path: Optional[str] = None,
+        sample_rates: Optional[Dict[str, float]] = None,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000
+    ):
+        self._owns_stream = path is not None
+        self._stream = open(path, "a", encoding="utf-8") if path else (stream or sys.stdout)
+        self.sample_rates = sample_rates or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def sample_rate(self, status_code: int) -> float:
+        rate = self.sample_rates.get(str(status_code))
+        if rate is None:
+            rate = self.sample_rates.get(f"{status_code // 100}xx", 1.0)
+        return rate
+
+    def log(self, timestamp: float, method: str, path: str, status_code: int,
+            duration: float, client: str) -> bool:
+        """Enfileira o registro de uma requisição; retorna False se não foi registrado"""
+        rate = self.sample_rate(status_code)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+        try:
+            self._queue.put_nowait((timestamp, method, path, status_code, duration, client, rate))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    @staticmethod
+    def _format(record: tuple) -> str:
+        timestamp, method, path, status_code, duration, client, rate = record
+        return json.dumps({
+            "ts": round(timestamp, 6),
+            "method": method,
+            "path": path,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "client": client,
+            "sample_rate": rate,
+        }, separators=(",", ":"))
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            taken = 1
+            while True:
+                if record is self._STOP:
+                    stopping = True
+                    break
+                batch.append(self._format(record))
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                    taken += 1
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    self._stream.write("\n".join(batch) + "\n")
+                    self._stream.flush()
+                except (OSError, ValueError) as e:
+                    logger.error(f"Erro ao escrever log de acesso: {e}")
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        """Aguarda a escrita de tudo que já foi enfileirado"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Escreve o que ainda está na fila e encerra a thread"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self._owns_stream:
+            self._stream.close()
+
+
+def create_access_logger() -> AccessLogger:
+    """Cria o log de acesso a partir de ACCESS_LOG_PATH e ACCESS_LOG_SAMPLE_RATES"""
+    return AccessLogger(
+        path=settings.ACCESS_LOG_PATH or None,
+        sample_rates=parse_sample_rates(settings.ACCESS_LOG_SAMPLE_RATES),
+        batch_size=settings.ACCESS_LOG_BATCH_SIZE
+    )
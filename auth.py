@@ -1,23 +1,71 @@
-from datetime import datetime, timedelta
-from typing import Optional
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple, Union
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from models import User
-from database import get_db
+from models import User, UserAuthChange
+from database import session_dependency, run_db
 from config import settings    
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-security = HTTPBearer()
+security = HTTPBearer(auto_error=False)
+
+# Executor dedicado ao bcrypt: cada rodada leva centenas de milissegundos e
+# travaria o event loop inteiro se executada diretamente nas rotas async
+_password_executor: Optional[ThreadPoolExecutor] = None
+_password_executor_lock = threading.Lock()
+
+# Limita trabalhos em execução + na fila; acima disso a requisição recebe 503
+_password_slots = threading.BoundedSemaphore(
+    max(settings.PASSWORD_HASH_WORKERS, 1) + max(settings.PASSWORD_HASH_MAX_PENDING, 0)
+)
+
+# Versão de autenticação por usuário (user_id -> auth_version) no modo
+# AUTH_CLAIMS_ONLY: um token só é aceito se carregar a versão atual. A fonte é
+# a coluna users.auth_version; a tabela guarda só os usuários já vistos por
+# este worker (id desconhecido é consultado no banco uma vez) e recebe a cada
+# AUTH_VERSION_REFRESH_INTERVAL segundos as revogações e remoções gravadas
+# em user_auth_changes por qualquer worker
+_auth_versions: Dict[int, int] = {}
+# Ids sem usuário (removidos ou inexistentes) -> até quando (time.monotonic())
+# recusar sem voltar ao banco
+_auth_misses: Dict[int, float] = {}
+# changed_at a partir do qual a próxima recarga lê user_auth_changes
+_auth_versions_synced_at: Optional[datetime] = None
+_auth_versions_lock = threading.Lock()
+# A recarga relê esta margem antes da anterior: uma mudança com changed_at
+# antigo mas confirmada depois da leitura não se perde (reaplicar não muda nada)
+_AUTH_CHANGE_OVERLAP = timedelta(seconds=30)
+
+# Cache LRU de tokens já decodificados: sha256(token) -> (TokenData, exp)
+# Evita refazer HMAC + parsing do JSON a cada requisição da mesma sessão
+_token_cache: "OrderedDict[bytes, Tuple[TokenData, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {"hits": 0, "misses": 0}
 
 class TokenData(BaseModel):
     username: Optional[str] = None
     user_id: Optional[int] = None
     user_type: Optional[str] = None
+    is_active: Optional[bool] = None
+    auth_version: Optional[int] = None
+
+class CurrentUser(BaseModel):
+    """Usuário reconstruído a partir das claims do token (AUTH_CLAIMS_ONLY)"""
+    id: int
+    username: str
+    user_type: str
+    is_active: bool
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -25,6 +73,46 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def _get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        with _password_executor_lock:
+            if _password_executor is None:
+                _password_executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    thread_name_prefix="password-hash"
+                )
+    return _password_executor
+
+def shutdown_password_executor() -> None:
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is not None:
+            _password_executor.shutdown(wait=False, cancel_futures=True)
+            _password_executor = None
+
+async def _run_password_job(func, *args):
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return func(*args)
+
+    if not _password_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado processando autenticações, tente novamente",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_password_executor(), func, *args)
+    finally:
+        _password_slots.release()
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_password_job(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=15)):
     to_encode = data.copy()
     if expires_delta:
@@ -35,7 +123,16 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
     
-def verify_token(token: str) -> Optional[TokenData]:
+def build_token_claims(user: User) -> dict:
+    return {
+        "sub": user.username,
+        "user_id": user.id,
+        "user_type": user.user_type,
+        "is_active": user.is_active,
+        "auth_version": user.auth_version or 0
+    }
+    
+def _decode_token(token: str) -> Tuple[Optional[TokenData], Optional[float]]:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -43,38 +140,177 @@ def verify_token(token: str) -> Optional[TokenData]:
         user_type: str = payload.get("user_type")
 
         if username is None:
-            return None
+            return None, None
 
-        return TokenData(username=username, user_id=user_id, user_type=user_type)
+        token_data = TokenData(
+            username=username,
+            user_id=user_id,
+            user_type=user_type,
+            is_active=payload.get("is_active"),
+            auth_version=payload.get("auth_version")
+        )
+        return token_data, payload.get("exp")
     except JWTError:
-        return None
+        return None, None
+
+def verify_token(token: str) -> Optional[TokenData]:
+    if settings.TOKEN_CACHE_SIZE <= 0:
+        return _decode_token(token)[0]
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is not None:
+            token_data, exp = entry
+            if exp > now:
+                _token_cache.move_to_end(key)
+                _token_cache_stats["hits"] += 1
+                return token_data
+            # Token expirado: sai do cache e passa pela validação completa
+            del _token_cache[key]
+        _token_cache_stats["misses"] += 1
+
+    token_data, exp = _decode_token(token)
+    # Só tokens válidos com exp entram no cache
+    if token_data is not None and exp is not None:
+        with _token_cache_lock:
+            _token_cache[key] = (token_data, float(exp))
+            _token_cache.move_to_end(key)
+            while len(_token_cache) > settings.TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return token_data
+
+def get_token_cache_stats() -> dict:
+    with _token_cache_lock:
+        return {**_token_cache_stats, "size": len(_token_cache)}
+
+def clear_token_cache() -> None:
+    with _token_cache_lock:
+        _token_cache.clear()
+        _token_cache_stats["hits"] = 0
+        _token_cache_stats["misses"] = 0
+
+def _remember_miss(user_id: int) -> None:
+    # Chamada com _auth_versions_lock
+    _auth_versions.pop(user_id, None)
+    _auth_misses[user_id] = time.monotonic() + settings.AUTH_VERSION_REFRESH_INTERVAL
+
+def set_auth_version(user_id: int, version: int) -> None:
+    """Versão gravada por este worker (criação ou revogação já confirmadas)"""
+    with _auth_versions_lock:
+        _auth_misses.pop(user_id, None)
+        if version > _auth_versions.get(user_id, -1):
+            _auth_versions[user_id] = version
+
+def forget_auth_version(user_id: int) -> None:
+    """Tira da tabela um usuário removido; seus tokens deixam de valer"""
+    with _auth_versions_lock:
+        _remember_miss(user_id)
+
+def is_auth_version_current(user_id: int, version: Optional[int]) -> bool:
+    current = _auth_versions.get(user_id)
+    return version is not None and current is not None and version >= current
+
+def _is_auth_version_known(user_id: int) -> bool:
+    # Sem entrada, ou com a de usuário ausente vencida, é preciso ir ao banco
+    return user_id in _auth_versions or _auth_misses.get(user_id, 0) > time.monotonic()
+
+def _load_user_auth_version(db: Session, user_id: int) -> None:
+    version = db.query(User.auth_version).filter(User.id == user_id, User.deleted_at.is_(None)).scalar()
+    with _auth_versions_lock:
+        if version is None:
+            _remember_miss(user_id)
+        elif not _is_auth_version_known(user_id):
+            # Um forget_auth_version durante a consulta prevalece sobre a leitura
+            _auth_versions[user_id] = version
+
+def refresh_auth_versions(db: Session) -> int:
+    """
+    Aplica à tabela as revogações e remoções gravadas desde a recarga anterior
+    Só atualiza usuários que já estão na tabela, então um id esquecido depois
+    da leitura não volta; os demais são consultados quando aparecerem. A
+    primeira execução só marca o ponto de partida. Retorna as linhas lidas
+    """
+    global _auth_versions_synced_at
+    started = datetime.now(timezone.utc)
+    changes = []
+    if _auth_versions_synced_at is not None:
+        changes = db.query(UserAuthChange.user_id, UserAuthChange.auth_version, UserAuthChange.deleted).filter(
+            UserAuthChange.changed_at >= _auth_versions_synced_at - _AUTH_CHANGE_OVERLAP
+        ).all()
+    now = time.monotonic()
+    with _auth_versions_lock:
+        for user_id, version, deleted in changes:
+            if deleted:
+                _remember_miss(user_id)
+            elif version > _auth_versions.get(user_id, version):
+                _auth_versions[user_id] = version
+        for user_id in [user_id for user_id, until in _auth_misses.items() if until <= now]:
+            del _auth_misses[user_id]
+        _auth_versions_synced_at = started
+    return len(changes)
+
+def _get_user_for_login(db: Session, username: str) -> Optional[User]:
     user = db.query(User).filter(User.username == username).first()
+    if user is not None:
+        # Devolve a conexão ao pool antes do bcrypt em vez de segurá-la durante o hash
+        db.expunge(user)
+        db.rollback()
+    return user
+
+def _get_user_by_username(db: Session, username: str) -> Optional[User]:
+    return db.query(User).filter(User.username == username).first()
+
+async def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    user = await run_db(db, _get_user_for_login, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
     
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
+def _user_from_claims(token_data: TokenData) -> Optional[CurrentUser]:
+    if token_data.user_id is None or token_data.user_type is None or token_data.is_active is None:
+        return None
+    if not is_auth_version_current(token_data.user_id, token_data.auth_version):
+        return None
+    return CurrentUser(
+        id=token_data.user_id,
+        username=token_data.username,
+        user_type=token_data.user_type,
+        is_active=token_data.is_active
+    )
+    
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security), db: Session = Depends(session_dependency)) -> Union[User, CurrentUser]:
    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
 
+   if credentials is None:
+       raise credentials_exception
    token_data = verify_token(credentials.credentials)
    if token_data is None:
        raise credentials_exception
-   user = db.query(User).filter(User.username == token_data.username).first()
+   if settings.AUTH_CLAIMS_ONLY:
+       # Confia nas claims assinadas; revogação pela tabela de versões, que só
+       # vai ao banco para ids que ela ainda não conhece (nem como ausentes)
+       if token_data.user_id is not None and not _is_auth_version_known(token_data.user_id):
+           await run_db(db, _load_user_auth_version, token_data.user_id)
+       user = _user_from_claims(token_data)
+       if user is None:
+           raise credentials_exception
+       return user
+   user = await run_db(db, _get_user_by_username, token_data.username)
    if user is None:
        raise credentials_exception
    return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     
     return current_user
 
-def require_admin(current_user: User = Depends(get_current_active_user)) -> User:
+async def require_admin(current_user: User = Depends(get_current_active_user)) -> User:
     if current_user.user_type != "admin":
         raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, 
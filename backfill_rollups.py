@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Reconstrói os rollups diários de estatísticas e os contadores de totais a
+partir das linhas existentes
+
+Uso: python backfill_rollups.py
+"""
+
+import logging
+
+from crud import backfill_rollups, reconcile_counters
+from database import create_tables, get_db_session
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    create_tables()
+    with get_db_session() as db:
+        backfill_rollups(db)
+        reconcile_counters(db)
+    logger.info("Rollups e contadores reconstruídos")
+
+
+if __name__ == "__main__":
+    main()
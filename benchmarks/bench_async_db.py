@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark: throughput de GET /data com sessões síncronas x assíncronas
+
+Sobe um servidor uvicorn para cada modo e dispara clientes concorrentes:
+- sync: SessionLocal síncrona (ASYNC_DATABASE=false)
+- async: AsyncEngine com aiosqlite (ASYNC_DATABASE=true)
+
+Cada cliente repete GET /data até o fim da janela de medição; requisições
+que passam de --timeout segundos contam como erro.
+
+Uso: python benchmarks/bench_async_db.py [--clients 128] [--seconds 10] [--items 50]
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8765
+
+
+def serve():
+    sys.path.insert(0, ROOT)
+    import uvicorn
+    from main import app
+    uvicorn.run(app, host="127.0.0.1", port=PORT, log_level="warning", access_log=False)
+
+
+async def run_load(clients: int, seconds: float, items: int, timeout: float) -> dict:
+    import httpx
+
+    user = {"username": "bench", "email": "bench@example.com", "password": "Bench1234"}
+    credentials = {"username": user["username"], "password": user["password"]}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=timeout) as client:
+        for _ in range(100):
+            try:
+                await client.get("/health")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        await client.post("/register", json=user)
+        token = (await client.post("/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for i in range(items):
+            await client.post("/data", json={"title": f"Item {i}", "content": "x" * 200}, headers=headers)
+
+        deadline = time.perf_counter() + seconds
+        latencies = []
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get("/data", headers=headers)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p95": latencies[math.ceil(len(latencies) * 0.95) - 1] if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=128)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+        return
+
+    print(f"{args.clients} clientes concorrentes, {args.seconds:.0f}s, {args.items} itens por página\n")
+    print(f"{'modo':<6} {'reqs':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'erros':>6}")
+    for label, async_database in (("sync", "false"), ("async", "true")):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{tmp}/bench.db",
+                DEBUG="false",
+                # O rate limit distorceria a medição
+                RATE_LIMIT_PER_MINUTE="1000000000",
+                ASYNC_DATABASE=async_database,
+            )
+            server = subprocess.Popen(
+                [sys.executable, __file__, "--serve"], env=env, cwd=ROOT,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                r = asyncio.run(run_load(args.clients, args.seconds, args.items, args.timeout))
+            finally:
+                server.kill()
+                server.wait()
+        print(
+            f"{label:<6} {r['requests']:>7} {r['rps']:>8.1f} "
+            f"{r['p50']:>9.1f} {r['p95']:>9.1f} {r['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
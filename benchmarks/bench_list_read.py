@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: leitura de uma página de GET /data (ORM x Core)
+
+Compara, para uma página de --rows itens num SQLite temporário:
+- orm: query ORM de DataItem + validação por DataItemResponse + JSON
+- core: get_data_item_rows + serializador pré-construído (sem validação por linha)
+
+Mede a latência mediana e o pico de memória (tracemalloc) de cada caminho.
+
+Uso: python benchmarks/bench_list_read.py [--rows 1000] [--runs 30]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from crud import data_item_columns, data_item_conditions, get_data_item_rows  # noqa: E402
+from main import json_serializer, rows_to_items  # noqa: E402
+from models import Base, DataItem, DataItemResponse, DATA_ITEM_FIELDS, User  # noqa: E402
+
+orm_adapter = TypeAdapter(List[DataItemResponse])
+
+
+def read_orm(db, rows: int) -> bytes:
+    items = (
+        db.query(DataItem)
+        .filter(*data_item_conditions())
+        .order_by(DataItem.created_at, DataItem.id)
+        .limit(rows).all()
+    )
+    return orm_adapter.dump_json(orm_adapter.validate_python(items, from_attributes=True))
+
+
+def read_core(db, rows: int) -> bytes:
+    columns = data_item_columns(DATA_ITEM_FIELDS)
+    return json_serializer.dump_json(rows_to_items(get_data_item_rows(db, columns, limit=rows), DATA_ITEM_FIELDS))
+
+
+def measure(Session, read, rows: int, runs: int):
+    timings = []
+    for _ in range(runs):
+        db = Session()
+        start = time.perf_counter()
+        read(db, rows)
+        timings.append(time.perf_counter() - start)
+        db.close()
+
+    db = Session()
+    tracemalloc.start()
+    read(db, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+    return statistics.median(timings) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+        with Session() as db:
+            user = User(username="bench", email="bench@example.com", hashed_password="x")
+            db.add(user)
+            db.flush()
+            db.add_all(
+                DataItem(title=f"Item {i}", content="conteúdo " * 40, user_id=user.id)
+                for i in range(args.rows)
+            )
+            db.commit()
+
+        results = {name: measure(Session, read, args.rows, args.runs)
+                   for name, read in (("orm", read_orm), ("core", read_core))}
+        engine.dispose()
+
+    print(f"Página de {args.rows} itens, mediana de {args.runs} execuções\n")
+    print(f"{'caminho':<8} {'ms':>8} {'pico KiB':>10}")
+    for name, (latency, peak) in results.items():
+        print(f"{name:<8} {latency:>8.2f} {peak:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
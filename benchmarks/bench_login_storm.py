@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: latência de GET /data durante uma tempestade de logins
+
+Executa o mesmo cenário duas vezes, em subprocessos separados:
+- antes: bcrypt executado diretamente no event loop (PASSWORD_HASH_WORKERS=0)
+- depois: bcrypt no executor dedicado (PASSWORD_HASH_WORKERS=4)
+
+GET /data é sondado sequencialmente enquanto a tempestade durar; a coluna
+"sondas" mostra quantas requisições conseguiram ser atendidas nesse tempo.
+
+Uso: python benchmarks/bench_login_storm.py [--logins 32]
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_scenario(logins: int) -> dict:
+    sys.path.insert(0, ROOT)
+    import httpx
+    from main import app
+    from database import create_tables
+    create_tables()
+
+    user = {"username": "bench", "email": "bench@example.com", "password": "Bench1234"}
+    credentials = {"username": user["username"], "password": user["password"]}
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        await client.post("/register", json=user)
+        token = (await client.post("/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async def probe_data(storm_done: asyncio.Event) -> list:
+            # Sonda /data continuamente enquanto a tempestade de logins durar
+            latencies = []
+            while not storm_done.is_set() or not latencies:
+                start = time.perf_counter()
+                await client.get("/data", headers=headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.005)
+            return latencies
+
+        async def login_storm(storm_done: asyncio.Event) -> list:
+            responses = await asyncio.gather(
+                *(client.post("/login", json=credentials) for _ in range(logins))
+            )
+            storm_done.set()
+            return responses
+
+        storm_done = asyncio.Event()
+        start = time.perf_counter()
+        latencies, responses = await asyncio.gather(
+            probe_data(storm_done), login_storm(storm_done)
+        )
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    statuses = [r.status_code for r in responses]
+    return {
+        "probes": len(latencies),
+        "p50": statistics.median(latencies),
+        "p95": latencies[math.ceil(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+        "elapsed": elapsed,
+        "ok": statuses.count(200),
+        "rejected": statuses.count(503),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run_scenario(args.logins))
+        print(" ".join(f"{k}={v}" for k, v in result.items()))
+        return
+
+    print(f"{args.logins} logins concorrentes, GET /data sequenciais durante a tempestade\n")
+    print(f"{'modo':<8} {'sondas':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'total s':>8} {'200':>5} {'503':>5}")
+    for label, workers in (("antes", "0"), ("depois", "4")):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{tmp}/bench.db",
+                DEBUG="false",
+                # O rate limit distorceria a medição
+                RATE_LIMIT_PER_MINUTE="1000000000",
+                PASSWORD_HASH_WORKERS=workers,
+            )
+            output = subprocess.run(
+                [sys.executable, __file__, "--child",
+                 "--logins", str(args.logins)],
+                env=env, capture_output=True, text=True, check=True, cwd=ROOT
+            ).stdout.strip().splitlines()[-1]
+        r = dict(item.split("=") for item in output.split())
+        print(
+            f"{label:<8} {r['probes']:>7} {float(r['p50']):>9.1f} {float(r['p95']):>9.1f} "
+            f"{float(r['max']):>9.1f} {float(r['elapsed']):>8.2f} {r['ok']:>5} {r['rejected']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark: overhead por requisição da pilha de middlewares
+
+Compara, chamando o ASGI diretamente (sem rede):
+- nenhum: rota sem middlewares (referência)
+- antiga: SecurityMiddleware + LoggingMiddleware + RateLimitMiddleware (BaseHTTPMiddleware)
+- nova: APIMiddleware (ASGI puro)
+
+O logging fica em WARNING para medir só o custo estrutural das pilhas.
+
+Uso: python benchmarks/bench_middleware.py [--requests 2000]
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import sys
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+
+from middleware import APIMiddleware  # noqa: E402
+from rate_limit import MemoryRateLimiter, RateLimitBackend  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+# Pilha antiga (BaseHTTPMiddleware), mantida aqui só como referência de medida
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """Middleware para controle de taxa de requisições"""
+    
+    def __init__(self, app, requests_per_minute: int = 60, limiter: Optional[RateLimitBackend] = None):
+        super().__init__(app)
+        self.requests_per_minute = requests_per_minute
+        self.limiter = limiter if limiter is not None else MemoryRateLimiter(requests_per_minute)
+    
+    async def dispatch(self, request: Request, call_next):
+        client_ip = request.client.host
+        
+        result = await self.limiter.acquire(client_ip)
+        
+        if not result.allowed:
+            return JSONResponse(
+                status_code=429,
+                content={
+                    "error": "Rate limit exceeded",
+                    "message": f"Máximo de {self.requests_per_minute} requisições por minuto excedido"
+                },
+                headers={
+                    "Retry-After": str(math.ceil(result.retry_after)),
+                    "X-RateLimit-Limit": str(result.limit),
+                    "X-RateLimit-Remaining": "0"
+                }
+            )
+        
+        response = await call_next(request)
+        response.headers["X-RateLimit-Limit"] = str(result.limit)
+        response.headers["X-RateLimit-Remaining"] = str(result.remaining)
+        return response
+
+
+class LoggingMiddleware(BaseHTTPMiddleware):
+    """Middleware para logging de requisições"""
+    
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.perf_counter()
+        
+        logger.info(f"Requisição {request.method} {request.url.path} de {request.client.host}")
+        
+        response = await call_next(request)
+        
+        process_time = time.perf_counter() - start_time
+        
+        logger.info(
+            f"Resposta {response.status_code} para {request.method} {request.url.path} "
+            f"em {process_time:.3f}s"
+        )
+        
+        response.headers["X-Process-Time"] = str(process_time)
+        
+        return response
+
+
+class SecurityMiddleware(BaseHTTPMiddleware):
+    """Middleware para headers de segurança"""
+    
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        
+        return response
+
+
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    limiter = MemoryRateLimiter(requests_per_minute=10**9)
+    if stack == "antiga":
+        app.add_middleware(SecurityMiddleware)
+        app.add_middleware(LoggingMiddleware)
+        app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    elif stack == "nova":
+        app.add_middleware(APIMiddleware, limiter=limiter)
+    return app
+
+
+async def measure(app: FastAPI, requests: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/ping", "raw_path": b"/ping",
+        "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+    async def send(message):
+        pass
+
+    async def request_once():
+        # Entrega o corpo uma vez; depois fica "conectado" até ser cancelado
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        await app(dict(scope), receive, send)
+
+    for _ in range(200):
+        await request_once()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await request_once()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+
+    results = {stack: asyncio.run(measure(build_app(stack), args.requests))
+               for stack in ("nenhum", "antiga", "nova")}
+
+    print(f"{args.requests} requisições GET /ping\n")
+    print(f"{'pilha':<8} {'us/req':>8} {'overhead us':>12}")
+    for stack, cost in results.items():
+        print(f"{stack:<8} {cost:>8.1f} {cost - results['nenhum']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark: custo por verificação dos limitadores de taxa
+
+Compara MemoryRateLimiter (estado por processo) e SharedMemoryRateLimiter
+(tabela mmap compartilhada entre workers) com um conjunto fixo de IPs.
+
+Uso: python benchmarks/bench_rate_limit.py [--hits 200000] [--keys 1000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rate_limit import MemoryRateLimiter, SharedMemoryRateLimiter  # noqa: E402
+
+
+def measure(limiter, keys: list, hits: int) -> float:
+    start = time.perf_counter()
+    for i in range(hits):
+        limiter.hit(keys[i % len(keys)])
+    return (time.perf_counter() - start) / hits * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hits", type=int, default=200000)
+    parser.add_argument("--keys", type=int, default=1000)
+    args = parser.parse_args()
+
+    keys = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(args.keys)]
+    # Limite alto: mede o caminho de requisição aceita, que grava estado
+    options = dict(requests_per_minute=10**9, max_keys=10000)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limiters = {
+            "memory": MemoryRateLimiter(**options),
+            "shm": SharedMemoryRateLimiter(os.path.join(tmp, "ratelimit"), **options),
+        }
+        print(f"{args.hits} verificações sobre {args.keys} chaves\n")
+        print(f"{'backend':<8} {'us/hit':>8}")
+        for name, limiter in limiters.items():
+            print(f"{name:<8} {measure(limiter, keys, args.hits):>8.2f}")
+        limiters["shm"].close()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,8 @@ class Settings:
         "DATABASE_URL", 
         "sqlite:///./app.db"
     )
+    # Usa AsyncEngine (aiosqlite/asyncpg) e sessões assíncronas nas rotas
+    ASYNC_DATABASE: bool = os.getenv("ASYNC_DATABASE", "False").lower() == "true"
     
     # Configurações de segurança
     SECRET_KEY: str = os.getenv(
@@ -31,6 +33,53 @@ class Settings:
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(
         os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
     )
+    # Tamanho do cache LRU de tokens decodificados (0 desabilita)
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    # Autentica apenas pelas claims do token (sem consultar o usuário no banco)
+    AUTH_CLAIMS_ONLY: bool = os.getenv("AUTH_CLAIMS_ONLY", "False").lower() == "true"
+    # Intervalo (segundos) da recarga incremental das versões de autenticação
+    # no modo AUTH_CLAIMS_ONLY; limita quanto tempo outro worker aceita um
+    # token revogado e quanto tempo um id sem usuário é recusado sem consulta
+    AUTH_VERSION_REFRESH_INTERVAL: int = int(os.getenv("AUTH_VERSION_REFRESH_INTERVAL", "30"))
+    
+    # Configurações do hashing de senhas (bcrypt fora do event loop)
+    # PASSWORD_HASH_WORKERS=0 executa o bcrypt diretamente no event loop
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+    PASSWORD_HASH_MAX_PENDING: int = int(
+        os.getenv("PASSWORD_HASH_MAX_PENDING", "32")
+    )
+    
+    # Tamanho máximo de página nas listagens (limit maior é reduzido)
+    MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", "500"))
+    # Máximo de itens por requisição em POST /data/batch
+    MAX_BATCH_SIZE: int = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+    # Linhas lidas do banco por lote em GET /data/export
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    # POST /data/import: itens por commit, tamanho máximo de uma linha NDJSON
+    # e quantos erros são detalhados na resposta (os demais só são contados)
+    IMPORT_CHUNK_SIZE: int = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+    IMPORT_MAX_LINE_BYTES: int = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+    IMPORT_MAX_ERRORS: int = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+    
+    # Intervalo (segundos) da reconciliação dos contadores de totais (0 desabilita)
+    COUNTER_RECONCILE_INTERVAL: int = int(os.getenv("COUNTER_RECONCILE_INTERVAL", "3600"))
+    
+    # Remoção de usuários: acima de USER_PURGE_THRESHOLD itens a exclusão é
+    # lógica e os itens são apagados em segundo plano, em lotes de
+    # USER_PURGE_BATCH_SIZE a cada USER_PURGE_INTERVAL segundos (0 desabilita)
+    USER_PURGE_THRESHOLD: int = int(os.getenv("USER_PURGE_THRESHOLD", "10000"))
+    USER_PURGE_BATCH_SIZE: int = int(os.getenv("USER_PURGE_BATCH_SIZE", "500"))
+    USER_PURGE_INTERVAL: int = int(os.getenv("USER_PURGE_INTERVAL", "60"))
+    
+    # Validade (segundos) das respostas guardadas por Idempotency-Key e
+    # intervalo da limpeza das expiradas (0 desabilita a limpeza)
+    IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    IDEMPOTENCY_PURGE_INTERVAL: int = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+    
+    # Sweeper de itens vencidos (expires_at): intervalo em segundos (0
+    # desabilita) e itens apagados por transação
+    EXPIRY_SWEEP_INTERVAL: int = int(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+    EXPIRY_SWEEP_BATCH_SIZE: int = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "500"))
     
     # Configurações de CORS
     CORS_ORIGINS: list = os.getenv(
@@ -38,8 +87,28 @@ class Settings:
         "*"
     ).split(",")
     
+    # Configurações de rate limit (GCRA por IP)
+    RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+    RATE_LIMIT_BURST: int = int(
+        os.getenv("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MINUTE))
+    )
+    RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+    # memory (por processo), shm (entre workers via mmap) ou redis (entre nós)
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_SHM_PATH: str = os.getenv("RATE_LIMIT_SHM_PATH", "")
+    # Backend redis: estado compartilhado entre nós atrás do load balancer
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_REDIS_BATCH: int = int(os.getenv("RATE_LIMIT_REDIS_BATCH", "5"))
+    RATE_LIMIT_REDIS_TIMEOUT: float = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+    RATE_LIMIT_NODES: int = int(os.getenv("RATE_LIMIT_NODES", "1"))
+    
     # Configurações de logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # Log de acesso em JSON (vazio = stdout) e amostragem por status,
+    # ex.: "5xx=1,4xx=1,2xx=0.01"; status sem regra são sempre registrados
+    ACCESS_LOG_PATH: str = os.getenv("ACCESS_LOG_PATH", "")
+    ACCESS_LOG_SAMPLE_RATES: str = os.getenv("ACCESS_LOG_SAMPLE_RATES", "")
+    ACCESS_LOG_BATCH_SIZE: int = int(os.getenv("ACCESS_LOG_BATCH_SIZE", "256"))
 
 # Instância global das configurações
 settings = Settings()
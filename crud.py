@@ -1,12 +1,184 @@
+import base64
+import json
+from collections import Counter as Tally
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import (
+    DateTime, Float, Integer, String, Text, bindparam, delete, func, insert, literal, or_, select, text, true,
+    tuple_, update
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import DATETIME as SQLiteDateTime, insert as sqlite_insert
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
-from typing import List, Optional
-from models import User, DataItem, UserCreate, UserUpdate, DataItemCreate, DataItemUpdate
-from auth import get_password_hash
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from models import (
+    User, DataItem, Counter, DailyUserActivity, DailySystemStats, UserCreate, UserUpdate, DataItemCreate, DataItemUpdate, DataItemFilters,
+    IdempotencyKey, DataItemResponse, UserAuthChange, POSTGRES_SEARCH_VECTOR
+)
+from auth import forget_auth_version, get_password_hash, set_auth_version
 
-def create_user(db: Session, user: UserCreate) -> User:
-    hashed_password = get_password_hash(user.password)
+USERS_COUNTER = "users"
+DATA_ITEMS_COUNTER = "data_items"
+
+def _upsert_insert(db: Session):
+    return {"sqlite": sqlite_insert, "postgresql": postgresql_insert}[db.get_bind().dialect.name]
+
+def bump_counters(db: Session, deltas: Dict[Tuple[str, int], int]) -> None:
+    # Soma os deltas em um único upsert na transação corrente; chaves são
+    # (nome, user_id), com user_id=0 para o total global
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    statement = _upsert_insert(db)(Counter).values([
+        {"name": name, "user_id": user_id, "value": delta}
+        for (name, user_id), delta in deltas.items()
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[Counter.name, Counter.user_id],
+        set_={"value": Counter.value + statement.excluded.value}
+    ))
+
+def data_item_deltas(user_ids: List[int], sign: int = 1) -> Dict[Tuple[str, int], int]:
+    # Deltas do total global e dos totais por usuário para itens criados/removidos
+    per_user = Tally(user_ids)
+    deltas = {(DATA_ITEMS_COUNTER, 0): sign * len(user_ids)}
+    deltas.update({(DATA_ITEMS_COUNTER, user_id): sign * count for user_id, count in per_user.items()})
+    return deltas
+
+def get_counter(db: Session, name: str, user_id: int = 0) -> int:
+    value = db.execute(
+        select(Counter.value).where(Counter.name == name, Counter.user_id == user_id)
+    ).scalar_one_or_none()
+    return value or 0
+
+def reconcile_counters(db: Session) -> None:
+    """
+    Recalcula os contadores a partir das tabelas, corrigindo divergências
+    Cada contador é reescrito por um único INSERT ... SELECT ... ON CONFLICT
+    """
+    insert_ = _upsert_insert(db)
+    # WHERE explícito: sem ele o SQLite lê ON CONFLICT como parte do SELECT
+    sources = [
+        select(literal(USERS_COUNTER), literal(0), func.count()).select_from(User).where(true()),
+        select(literal(DATA_ITEMS_COUNTER), literal(0), func.count()).select_from(DataItem).where(true()),
+        select(literal(DATA_ITEMS_COUNTER), DataItem.user_id, func.count())
+        .where(true()).group_by(DataItem.user_id),
+    ]
+    for source in sources:
+        statement = insert_(Counter).from_select(["name", "user_id", "value"], source)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[Counter.name, Counter.user_id],
+            set_={"value": statement.excluded.value}
+        ))
+    # Usuários que não têm mais itens
+    db.execute(
+        update(Counter)
+        .where(
+            Counter.name == DATA_ITEMS_COUNTER, Counter.user_id != 0, Counter.value != 0,
+            Counter.user_id.not_in(select(DataItem.user_id))
+        )
+        .values(value=0)
+    )
+    db.commit()
+
+def record_activity(db: Session, user_id: int, items_created: int = 0, now: Optional[datetime] = None) -> None:
+    """
+    Atualiza os rollups diários com uma atividade do usuário, na transação corrente
+    A primeira atividade do dia cria a linha do usuário e conta como usuário ativo
+    """
+    now = now or datetime.now(timezone.utc)
+    today = now.date()
+    insert_ = _upsert_insert(db)
+    first_today = db.execute(
+        insert_(DailyUserActivity)
+        .values(user_id=user_id, day=today, items_created=items_created, last_activity_at=now)
+        .on_conflict_do_nothing()
+    ).rowcount == 1
+    if not first_today:
+        db.execute(
+            update(DailyUserActivity)
+            .where(DailyUserActivity.user_id == user_id, DailyUserActivity.day == today)
+            .values(items_created=DailyUserActivity.items_created + items_created, last_activity_at=now)
+        )
+    active = 1 if first_today else 0
+    if active or items_created:
+        statement = insert_(DailySystemStats).values(day=today, active_users=active, items_created=items_created)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[DailySystemStats.day],
+            set_={
+                "active_users": DailySystemStats.active_users + statement.excluded.active_users,
+                "items_created": DailySystemStats.items_created + statement.excluded.items_created,
+            }
+        ))
+
+def record_login(db: Session, user_id: int) -> None:
+    record_activity(db, user_id)
+    db.commit()
+
+def get_user_stats(db: Session, user_id: int, today: Optional[date] = None) -> dict:
+    # Leituras por chave primária: no máximo um mês de linhas do usuário
+    today = today or datetime.now(timezone.utc).date()
+    last_activity = db.execute(
+        select(DailyUserActivity.last_activity_at)
+        .where(DailyUserActivity.user_id == user_id)
+        .order_by(DailyUserActivity.day.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+    items_this_month = db.execute(
+        select(func.coalesce(func.sum(DailyUserActivity.items_created), 0))
+        .where(DailyUserActivity.user_id == user_id, DailyUserActivity.day >= today.replace(day=1))
+    ).scalar_one()
+    return {
+        "total_items": get_counter(db, DATA_ITEMS_COUNTER, user_id),
+        "last_activity": last_activity,
+        "items_this_month": items_this_month,
+    }
+
+def get_system_stats(db: Session, today: Optional[date] = None) -> dict:
+    today = today or datetime.now(timezone.utc).date()
+    daily = db.get(DailySystemStats, today)
+    return {
+        "total_users": get_counter(db, USERS_COUNTER),
+        "total_items": get_counter(db, DATA_ITEMS_COUNTER),
+        "active_users_today": daily.active_users if daily else 0,
+        "items_created_today": daily.items_created if daily else 0,
+    }
+
+def backfill_rollups(db: Session) -> None:
+    """
+    Reconstrói os rollups diários a partir de data_items
+    Logins passados não ficam registrados em lugar nenhum: só a criação de
+    itens entra no histórico reconstruído
+    """
+    insert_ = _upsert_insert(db)
+    day = func.date(DataItem.created_at)
+    per_user = (
+        select(DataItem.user_id, day, func.count(), func.max(DataItem.created_at))
+        .where(true()).group_by(DataItem.user_id, day)
+    )
+    statement = insert_(DailyUserActivity).from_select(
+        ["user_id", "day", "items_created", "last_activity_at"], per_user
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[DailyUserActivity.user_id, DailyUserActivity.day],
+        set_={"items_created": statement.excluded.items_created, "last_activity_at": statement.excluded.last_activity_at}
+    ))
+    per_day = (
+        select(DailyUserActivity.day, func.count(), func.sum(DailyUserActivity.items_created))
+        .where(true()).group_by(DailyUserActivity.day)
+    )
+    statement = insert_(DailySystemStats).from_select(["day", "active_users", "items_created"], per_day)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[DailySystemStats.day],
+        set_={"active_users": statement.excluded.active_users, "items_created": statement.excluded.items_created}
+    ))
+    db.commit()
+
+def create_user(db: Session, user: UserCreate, hashed_password: Optional[str] = None) -> User:
+    # Rotas async passam o hash já calculado no executor de senhas
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = User(
         username=user.username, 
         email=user.email, 
@@ -15,8 +187,10 @@ def create_user(db: Session, user: UserCreate) -> User:
     )
     try:
         db.add(db_user)
+        bump_counters(db, {(USERS_COUNTER, 0): 1})
         db.commit()
         db.refresh(db_user)
+        set_auth_version(db_user.id, db_user.auth_version)
         return db_user
     except IntegrityError:
         db.rollback()
@@ -34,83 +208,529 @@ def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
 def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[User]:
     return db.query(User).offset(skip).limit(limit).all()
 
+# O SQLite grava CURRENT_TIMESTAMP (UTC) sem microssegundos; datas comparadas
+# com created_at precisam do mesmo formato, senão empates no mesmo segundo
+# (ex.: no cursor, desempatados pelo id) comparam errado
+_STORED_TIMESTAMP = DateTime(timezone=True).with_variant(
+    SQLiteDateTime(truncate_microseconds=True), "sqlite"
+)
+
+def _timestamp(value: datetime):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return literal(value, _STORED_TIMESTAMP)
+
+def _not_expired():
+    # Itens vencidos somem das leituras na hora, antes de o sweeper apagá-los
+    return or_(DataItem.expires_at.is_(None), DataItem.expires_at > _timestamp(datetime.now(timezone.utc)))
+
+def _encode_cursor_values(values: list) -> str:
+    payload = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_cursor_values(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    return _encode_cursor_values([created_at.isoformat(), row_id])
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, row_id = _decode_cursor_values(cursor)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+
+def _after_cursor(model, cursor: str):
+    # Condição de keyset: linhas depois do cursor em (created_at, id) decrescente
+    created_at, row_id = decode_cursor(cursor)
+    return tuple_(model.created_at, model.id) < tuple_(_timestamp(created_at), literal(row_id))
+
+def _split_page(rows: list, limit: int):
+    # As consultas buscam limit + 1 linhas: a sobra indica que há próxima página
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+def _keyset_page(query, model, limit: int, cursor: Optional[str]):
+    """
+    Página por (created_at, id) decrescente a partir do cursor, sem OFFSET
+    Retorna os itens e o cursor da próxima página (None na última)
+    """
+    if cursor:
+        query = query.filter(_after_cursor(model, cursor))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    return _split_page(rows, limit)
+
+def get_users_page(db: Session, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[User], Optional[str]]:
+    return _keyset_page(db.query(User), User, limit, cursor)
+
 def update_user(db: Session, user_id: int, user_update: UserUpdate) -> Optional[User]:
     db_user = get_user_by_id(db, user_id)
     if not db_user:
         return None
    
     update_data = user_update.dict(exclude_unset=True)
+    # Campos carregados no token: alterá-los invalida os tokens já emitidos
+    revokes_tokens = any(
+        key in update_data and update_data[key] != getattr(db_user, key)
+        for key in ("username", "user_type", "is_active")
+    )
     for key, value in update_data.items():
         if hasattr(db_user, key):
             setattr(db_user, key, value)
+    if revokes_tokens:
+        db_user.auth_version = (db_user.auth_version or 0) + 1
+        _record_auth_change(db, db_user.id, db_user.auth_version)
     
     try:
         db.commit()
         db.refresh(db_user)
+        if revokes_tokens:
+            set_auth_version(db_user.id, db_user.auth_version)
         return db_user
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Dados inválidos para atualização")
 
+def _record_auth_change(db: Session, user_id: int, auth_version: int, deleted: bool = False) -> None:
+    # Lido pelos outros workers em refresh_auth_versions; vai no mesmo commit
+    # da alteração do usuário
+    db.add(UserAuthChange(
+        user_id=user_id, auth_version=auth_version, deleted=deleted, changed_at=datetime.now(timezone.utc)
+    ))
+
+def purge_user_auth_changes(db: Session, max_age: timedelta) -> int:
+    """Apaga os registros mais antigos que max_age (a validade dos tokens)"""
+    cutoff = datetime.now(timezone.utc) - max_age
+    result = db.execute(delete(UserAuthChange).where(UserAuthChange.changed_at <= cutoff))
+    db.commit()
+    return result.rowcount
+
+def _delete_user_row(db: Session, user_id: int, item_count: int) -> None:
+    # Bancos criados antes do ON DELETE CASCADE não têm a constraint (o
+    # create_tables só acrescenta colunas), então os itens saem aqui num
+    # único DELETE, sem passar pela sessão
+    db.execute(
+        delete(DataItem).where(DataItem.user_id == user_id),
+        execution_options={"synchronize_session": False}
+    )
+    db.execute(delete(User).where(User.id == user_id))
+    bump_counters(db, {(USERS_COUNTER, 0): -1, (DATA_ITEMS_COUNTER, 0): -item_count})
+    db.execute(delete(Counter).where(Counter.user_id == user_id))
+
 def delete_user(db: Session, user_id: int) -> bool:
     db_user = get_user_by_id(db, user_id)
-    if not db_user:
+    if not db_user or db_user.deleted_at is not None:
         return False
 
-    db.delete(db_user)
+    _delete_user_row(db, user_id, get_counter(db, DATA_ITEMS_COUNTER, user_id))
+    _record_auth_change(db, user_id, (db_user.auth_version or 0) + 1, deleted=True)
     db.commit()
+    forget_auth_version(user_id)
     return True
 
-def create_data_item(db: Session, data_item: DataItemCreate) -> DataItem:
+def soft_delete_user(db: Session, user_id: int) -> bool:
+    # Desativa o usuário e revoga os tokens; a remoção dos itens e da linha
+    # fica para purge_deleted_users. Os contadores só mudam quando as linhas
+    # são de fato apagadas, então a reconciliação continua valendo
+    db_user = get_user_by_id(db, user_id)
+    if not db_user or db_user.deleted_at is not None:
+        return False
+
+    db_user.deleted_at = datetime.now(timezone.utc)
+    db_user.is_active = False
+    db_user.auth_version = (db_user.auth_version or 0) + 1
+    _record_auth_change(db, user_id, db_user.auth_version, deleted=True)
+    db.commit()
+    forget_auth_version(user_id)
+    return True
+
+def purge_deleted_users(db: Session, batch_size: int = 500) -> int:
+    """
+    Apaga os itens dos usuários com exclusão lógica em lotes de batch_size,
+    um commit por lote para não segurar o lock de escrita, e depois o
+    próprio usuário. Retorna quantos usuários foram removidos
+    """
+    user_ids = db.scalars(select(User.id).where(User.deleted_at.isnot(None))).all()
+    for user_id in user_ids:
+        while True:
+            batch = select(DataItem.id).where(DataItem.user_id == user_id).limit(batch_size)
+            deleted = db.execute(
+                delete(DataItem).where(DataItem.id.in_(batch.scalar_subquery())),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            bump_counters(db, data_item_deltas([user_id] * deleted, -1))
+            db.commit()
+            if deleted < batch_size:
+                break
+        _delete_user_row(db, user_id, 0)
+        db.commit()
+    return len(user_ids)
+
+def _add_data_item(db: Session, data_item: DataItemCreate, user_id: int) -> DataItem:
     db_data_item = DataItem(
-        name=data_item.name,
-        description=data_item.description,
-        user_id=data_item.user_id
+        title=data_item.title,
+        content=data_item.content,
+        expires_at=data_item.expires_at,
+        user_id=user_id
     )
 
     db.add(db_data_item)
+    bump_counters(db, data_item_deltas([user_id]))
+    record_activity(db, user_id, items_created=1)
+    return db_data_item
+
+def create_data_item(db: Session, data_item: DataItemCreate, user_id: int) -> DataItem:
+    db_data_item = _add_data_item(db, data_item, user_id)
     db.commit()
     db.refresh(db_data_item)
     return db_data_item
 
-def get_data_item(db: Session, item_id: str) -> Optional[DataItem]:
-    return db.query(DataItem).filter(DataItem.id == item_id).first()
+def get_idempotent_response(db: Session, user_id: int, key: str) -> Optional[IdempotencyKey]:
+    # Chaves expiradas são ignoradas mesmo antes de a limpeza apagá-las
+    return db.execute(
+        select(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > datetime.now(timezone.utc)
+        )
+    ).scalar_one_or_none()
 
-def get_data_items_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[DataItem]:
-    return db.query(DataItem).filter(DataItem.user_id == user_id).offset(skip).limit(limit).all()
+def create_data_item_idempotent(
+    db: Session, data_item: DataItemCreate, user_id: int, key: str, request_hash: str, ttl: int
+) -> Tuple[Optional[IdempotencyKey], bool]:
+    """
+    Cria o item e guarda a resposta sob a chave na mesma transação
+    Retorna a resposta guardada e se o item foi criado aqui: se outro
+    processo gravou a mesma chave antes, a criação é desfeita e a resposta
+    dele é devolvida
+    """
+    now = datetime.now(timezone.utc)
+    db.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now
+    ))
+    db_data_item = _add_data_item(db, data_item, user_id)
+    db.flush()
+    db.refresh(db_data_item)
+    stored = IdempotencyKey(
+        user_id=user_id, key=key, request_hash=request_hash, status_code=200,
+        response=DataItemResponse.model_validate(db_data_item).model_dump_json(),
+        expires_at=now + timedelta(seconds=ttl)
+    )
+    db.add(stored)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return get_idempotent_response(db, user_id, key), False
+    return stored, True
 
-def get_all_data_items(db: Session, skip: int = 0, limit: int = 100) -> List[DataItem]:
-    return db.query(DataItem).offset(skip).limit(limit).all()
+def purge_idempotency_keys(db: Session) -> int:
+    result = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.now(timezone.utc)))
+    db.commit()
+    return result.rowcount
 
-def update_data_item(db: Session, item_id: str, data_item: DataItemUpdate) -> Optional[DataItem]:
-    db_data_item = get_data_item(db, item_id)
-    if not db_data_item:
-        return None
+def create_data_items(db: Session, data_items: List[DataItemCreate], user_id: int) -> List[int]:
+    # INSERT de várias linhas (insertmanyvalues) em uma transação. Pedir o
+    # RETURNING na ordem dos parâmetros faz o SQLite voltar a uma linha por
+    # comando; como ids autoincrementais crescem na ordem das linhas
+    # inseridas, ordená-los devolve a correspondência com os itens.
+    # render_nulls mantém expires_at=None nas linhas: sem ele o ORM omite a
+    # coluna e linhas com e sem validade viram INSERTs separados
+    rows = [
+        {"title": data_item.title, "content": data_item.content, "expires_at": data_item.expires_at, "user_id": user_id}
+        for data_item in data_items
+    ]
+    ids = db.scalars(
+        insert(DataItem).returning(DataItem.id), rows, execution_options={"render_nulls": True}
+    ).all()
+    bump_counters(db, data_item_deltas([user_id] * len(ids)))
+    record_activity(db, user_id, items_created=len(ids))
+    db.commit()
+    return sorted(ids)
 
-    update_data = data_item.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_data_item, key, value)
+def get_data_item(db: Session, item_id: int, owner_id: Optional[int] = None) -> Optional[DataItem]:
+    # owner_id restringe ao dono na própria consulta (None = sem restrição, admins)
+    query = db.query(DataItem).filter(DataItem.id == item_id, _not_expired())
+    if owner_id is not None:
+        query = query.filter(DataItem.user_id == owner_id)
+    return query.first()
 
-    db.commit()
-    db.refresh(db_data_item)
-    return db_data_item
+def data_item_exists(db: Session, item_id: int) -> bool:
+    # Usado só quando a operação restrita ao dono não encontra o item,
+    # para diferenciar 404 de 403
+    return db.execute(select(DataItem.id).where(DataItem.id == item_id, _not_expired())).first() is not None
 
-def delete_data_item(db: Session, item_id: str) -> bool:
-    db_data_item = get_data_item(db, item_id)
-    if not db_data_item:
-        return False
+def data_item_conditions(
+    filters: Optional[DataItemFilters] = None, owner_id: Optional[int] = None, ids: Optional[List[int]] = None
+) -> list:
+    # Condições WHERE compartilhadas pelas listagens e operações em massa
+    conditions = [_not_expired()]
+    if owner_id is not None:
+        conditions.append(DataItem.user_id == owner_id)
+    if ids is not None:
+        conditions.append(DataItem.id.in_(ids))
+    if filters is not None:
+        if filters.user_id is not None:
+            conditions.append(DataItem.user_id == filters.user_id)
+        if filters.title_prefix:
+            # Faixa [prefixo, prefixo + maior caractere): usa o índice de title
+            conditions.append(DataItem.title >= filters.title_prefix)
+            conditions.append(DataItem.title < filters.title_prefix + "\U0010ffff")
+        if filters.title_contains:
+            conditions.append(DataItem.title.contains(filters.title_contains, autoescape=True))
+        if filters.created_after is not None:
+            conditions.append(DataItem.created_at > _timestamp(filters.created_after))
+        if filters.created_before is not None:
+            conditions.append(DataItem.created_at < _timestamp(filters.created_before))
+    return conditions
 
-    db.delete(db_data_item)
-    db.commit()
-    return True
+def data_item_columns(fields: Sequence[str], excerpt: Optional[int] = None) -> list:
+    # Só as colunas pedidas (mais id e created_at, usados na ordenação e no
+    # cursor); com excerpt o conteúdo já vem cortado do banco
+    names = ["id", "created_at"] + [name for name in fields if name not in ("id", "created_at")]
+    columns = []
+    for name in names:
+        if name == "content" and excerpt:
+            columns.append(func.substr(DataItem.content, 1, excerpt).label("content"))
+        else:
+            columns.append(getattr(DataItem, name))
+    return columns
+
+# Leitura sem ORM para as listagens: select() Core de colunas devolve tuplas
+# (Row), sem identity map nem instrumentação de atributos por linha
+
+def get_data_item_rows(
+    db: Session, columns: list, skip: int = 0, limit: int = 100,
+    filters: Optional[DataItemFilters] = None, owner_id: Optional[int] = None
+) -> list:
+    statement = (
+        select(*columns)
+        .where(*data_item_conditions(filters, owner_id))
+        .order_by(DataItem.created_at, DataItem.id)
+        .offset(skip).limit(limit)
+    )
+    return db.execute(statement).all()
+
+def get_data_item_rows_page(
+    db: Session, columns: list, limit: int = 100, cursor: Optional[str] = None,
+    filters: Optional[DataItemFilters] = None, owner_id: Optional[int] = None
+) -> Tuple[list, Optional[str]]:
+    statement = select(*columns).where(*data_item_conditions(filters, owner_id))
+    if cursor:
+        statement = statement.where(_after_cursor(DataItem, cursor))
+    statement = statement.order_by(DataItem.created_at.desc(), DataItem.id.desc()).limit(limit + 1)
+    return _split_page(db.execute(statement).all(), limit)
 
-def can_access_data_item(db: Session, item_id: str, user_id: int, user_type: str) -> bool:
-    if user_type == "admin":
-        return True
+def iter_data_item_rows(
+    db: Session, columns: list, filters: Optional[DataItemFilters] = None,
+    owner_id: Optional[int] = None, batch_size: int = 1000
+) -> Iterator[list]:
+    # Cursor do lado do servidor (yield_per liga stream_results): as linhas
+    # chegam em lotes de batch_size, sem carregar o resultado inteiro
+    statement = (
+        select(*columns)
+        .where(*data_item_conditions(filters, owner_id))
+        .order_by(DataItem.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = db.execute(statement)
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+# A página (dono, validade, cursor, ORDER BY e LIMIT) sai da própria
+# consulta do MATCH; highlight/snippet só são calculados para as linhas da
+# página, em uma segunda passada restrita aos rowids dela
+_SQLITE_RANK = "bm25(data_items_fts, 2.0, 1.0)"
+_SQLITE_SEARCH = f"""
+WITH page AS MATERIALIZED (
+    SELECT d.id, d.title, d.content, d.expires_at, d.user_id, d.version, d.created_at, d.updated_at,
+           {_SQLITE_RANK} AS rank
+    FROM data_items_fts JOIN data_items d ON d.id = data_items_fts.rowid
+    WHERE data_items_fts MATCH :query AND {{conditions}}
+    ORDER BY rank, d.id
+    LIMIT :limit
+)
+SELECT page.*,
+       highlight(data_items_fts, 0, '<mark>', '</mark>') AS title_highlight,
+       snippet(data_items_fts, 1, '<mark>', '</mark>', '…', 16) AS snippet
+FROM page JOIN data_items_fts ON data_items_fts.rowid = page.id
+WHERE data_items_fts MATCH :query
+ORDER BY page.rank, page.id
+"""
+
+# rank negativo para que, como no bm25 do SQLite, menor seja melhor
+_POSTGRES_RANK = f"-ts_rank_cd({POSTGRES_SEARCH_VECTOR}, q.query)"
+_POSTGRES_SEARCH = f"""
+WITH page AS MATERIALIZED (
+    SELECT d.id, d.title, d.content, d.expires_at, d.user_id, d.version, d.created_at, d.updated_at,
+           {_POSTGRES_RANK} AS rank, q.query AS tsquery
+    FROM data_items d, plainto_tsquery('simple', :query) AS q(query)
+    WHERE {POSTGRES_SEARCH_VECTOR} @@ q.query AND {{conditions}}
+    ORDER BY rank, d.id
+    LIMIT :limit
+)
+SELECT page.id, page.title, page.content, page.expires_at, page.user_id, page.version,
+       page.created_at, page.updated_at, page.rank,
+       ts_headline('simple', page.title, page.tsquery,
+                   'StartSel=<mark>, StopSel=</mark>, HighlightAll=true') AS title_highlight,
+       ts_headline('simple', page.content, page.tsquery,
+                   'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8') AS snippet
+FROM page
+ORDER BY page.rank, page.id
+"""
+
+def _fts_query(query: str) -> str:
+    # Cada termo vira uma frase entre aspas: os termos são combinados com AND
+    # e a sintaxe do FTS5 (NEAR, *, colunas) não é interpretada
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+def search_data_items(
+    db: Session, query: str, owner_id: Optional[int] = None, limit: int = 20, cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Busca textual em título e conteúdo ordenada por relevância
+    Paginada por cursor sobre (rank, id); owner_id restringe ao dono
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        template, rank_expression, query = _SQLITE_SEARCH, _SQLITE_RANK, _fts_query(query)
+    elif dialect == "postgresql":
+        template, rank_expression = _POSTGRES_SEARCH, _POSTGRES_RANK
+    else:
+        raise HTTPException(status_code=501, detail="Busca textual não suportada neste banco")
     
-    db_data_item = get_data_item(db, item_id)
-    if not db_data_item:
-        return False
+    conditions = ["(d.expires_at IS NULL OR d.expires_at > :now)"]
+    params = {"query": query, "limit": limit + 1, "now": datetime.now(timezone.utc).replace(tzinfo=None)}
+    if owner_id is not None:
+        conditions.append("d.user_id = :owner_id")
+        params["owner_id"] = owner_id
+    if cursor:
+        try:
+            rank, row_id = _decode_cursor_values(cursor)
+            params["cursor_rank"], params["cursor_id"] = float(rank), int(row_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError("Cursor inválido") from e
+        conditions.append(
+            f"({rank_expression} > :cursor_rank"
+            f" OR ({rank_expression} = :cursor_rank AND d.id > :cursor_id))"
+        )
     
-    return db_data_item.user_id == user_id
+    statement = text(template.format(conditions=" AND ".join(conditions))).bindparams(
+        bindparam("now", type_=_STORED_TIMESTAMP)
+    ).columns(
+        id=Integer, title=String, content=Text, expires_at=DateTime(timezone=True), user_id=Integer,
+        version=Integer, created_at=DateTime(timezone=True), updated_at=DateTime(timezone=True),
+        rank=Float, title_highlight=String, snippet=Text
+    )
+    rows = [dict(row._mapping) for row in db.execute(statement, params)]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor_values([rows[-1]["rank"], rows[-1]["id"]])
+
+def count_data_items(db: Session, conditions: list) -> int:
+    return db.execute(select(func.count()).select_from(DataItem).where(*conditions)).scalar_one()
+
+def bulk_update_data_items(
+    db: Session, data_item: DataItemUpdate, conditions: list, dry_run: bool = False
+) -> int:
+    # Um único UPDATE para todos os itens que atendem às condições
+    if dry_run:
+        return count_data_items(db, conditions)
+    result = db.execute(
+        update(DataItem).where(*conditions).values(
+            **data_item.model_dump(exclude_unset=True), version=DataItem.version + 1
+        ),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return result.rowcount
+
+def bulk_delete_data_items(db: Session, conditions: list, dry_run: bool = False) -> int:
+    if dry_run:
+        return count_data_items(db, conditions)
+    # RETURNING user_id para descontar os contadores de cada dono
+    owners = db.scalars(
+        delete(DataItem).where(*conditions).returning(DataItem.user_id),
+        execution_options={"synchronize_session": False}
+    ).all()
+    bump_counters(db, data_item_deltas(owners, sign=-1))
+    db.commit()
+    return len(owners)
+
+def sweep_expired_data_items(db: Session, batch_size: int = 500) -> int:
+    """
+    Apaga os itens vencidos em lotes de batch_size (pelo índice parcial de
+    expires_at), um commit por lote para não segurar o lock de escrita do
+    SQLite. Retorna quantos itens foram apagados
+    """
+    swept = 0
+    while True:
+        expired = (
+            select(DataItem.id)
+            .where(DataItem.expires_at <= _timestamp(datetime.now(timezone.utc)))
+            .limit(batch_size)
+        )
+        owners = db.scalars(
+            delete(DataItem).where(DataItem.id.in_(expired.scalar_subquery())).returning(DataItem.user_id),
+            execution_options={"synchronize_session": False}
+        ).all()
+        bump_counters(db, data_item_deltas(owners, sign=-1))
+        db.commit()
+        swept += len(owners)
+        if len(owners) < batch_size:
+            return swept
+
+def update_data_item(
+    db: Session, item_id: int, data_item: DataItemUpdate, owner_id: Optional[int] = None,
+    expected_versions: Optional[Sequence[int]] = None
+) -> Optional[DataItem]:
+    update_data = data_item.model_dump(exclude_unset=True)
+    if not update_data and expected_versions is None:
+        return get_data_item(db, item_id, owner_id)
+
+    # UPDATE ... RETURNING: altera e devolve o item em um único comando; com
+    # expected_versions a checagem da versão vai no mesmo WHERE (sem lock)
+    statement = update(DataItem).where(DataItem.id == item_id, _not_expired())
+    if owner_id is not None:
+        statement = statement.where(DataItem.user_id == owner_id)
+    if expected_versions is not None:
+        statement = statement.where(DataItem.version.in_(expected_versions))
+    statement = statement.values(**update_data, version=DataItem.version + 1).returning(DataItem)
+    db_data_item = db.execute(
+        statement, execution_options={"synchronize_session": False}
+    ).scalar_one_or_none()
+    if db_data_item is not None:
+        # Fora da sessão o commit não expira o objeto (evita um novo SELECT)
+        db.expunge(db_data_item)
+    db.commit()
+    return db_data_item
+
+def delete_data_item(
+    db: Session, item_id: int, owner_id: Optional[int] = None, expected_versions: Optional[Sequence[int]] = None
+) -> bool:
+    statement = delete(DataItem).where(DataItem.id == item_id, _not_expired())
+    if owner_id is not None:
+        statement = statement.where(DataItem.user_id == owner_id)
+    if expected_versions is not None:
+        statement = statement.where(DataItem.version.in_(expected_versions))
+    deleted = db.execute(
+        statement.returning(DataItem.user_id), execution_options={"synchronize_session": False}
+    ).first()
+    if deleted is not None:
+        bump_counters(db, data_item_deltas([deleted.user_id], sign=-1))
+    db.commit()
+    return deleted is not None
 
+def data_item_version(db: Session, item_id: int, owner_id: Optional[int] = None) -> Optional[int]:
+    # Só no caminho de falha de uma escrita condicional: separa 412 de 404/403
+    statement = select(DataItem.version).where(DataItem.id == item_id, _not_expired())
+    if owner_id is not None:
+        statement = statement.where(DataItem.user_id == owner_id)
+    return db.execute(statement).scalar_one_or_none()
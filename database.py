@@ -5,17 +5,32 @@ Inclui engine, sessões, migrações e utilitários de banco
 
 import logging
 from contextlib import contextmanager
-from typing import Generator, Optional
-from sqlalchemy import create_engine, event, text
-from sqlalchemy.engine import Engine
+from typing import Any, AsyncGenerator, Callable, Generator, Optional, TypeVar, Union
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.exc import SQLAlchemyError, OperationalError
 from config import settings
+from models import Base
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """Habilita foreign keys e ajustes de performance no SQLite"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=10000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
 
 def create_database_engine() -> Engine:
@@ -41,15 +56,7 @@ def create_database_engine() -> Engine:
         )
         
         # Habilita foreign keys no SQLite
-        @event.listens_for(engine, "connect")
-        def set_sqlite_pragma(dbapi_connection, connection_record):
-            cursor = dbapi_connection.cursor()
-            cursor.execute("PRAGMA foreign_keys=ON")
-            cursor.execute("PRAGMA journal_mode=WAL")
-            cursor.execute("PRAGMA synchronous=NORMAL")
-            cursor.execute("PRAGMA cache_size=10000")
-            cursor.execute("PRAGMA temp_store=MEMORY")
-            cursor.close()
+        event.listen(engine, "connect", _set_sqlite_pragma)
             
     elif "postgresql" in settings.DATABASE_URL:
         # PostgreSQL para produção
@@ -82,9 +89,73 @@ def create_database_engine() -> Engine:
     
     return engine
 
+def get_async_database_url(database_url: str) -> str:
+    """
+    Converte a URL síncrona para o driver assíncrono equivalente
+    sqlite -> aiosqlite, postgresql -> asyncpg
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+def create_async_database_engine() -> AsyncEngine:
+    """
+    Cria o engine assíncrono (ASYNC_DATABASE=true) com as mesmas
+    configurações de pool do engine síncrono
+    """
+    database_url = get_async_database_url(settings.DATABASE_URL)
+    
+    if "sqlite" in database_url:
+        async_engine = create_async_engine(
+            database_url,
+            connect_args={"timeout": 20, "isolation_level": None},
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=settings.DEBUG
+        )
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragma)
+        
+    elif "postgresql" in database_url:
+        async_engine = create_async_engine(
+            database_url,
+            pool_size=20,
+            max_overflow=30,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=settings.DEBUG,
+            connect_args={
+                "timeout": 10,
+                "server_settings": {"application_name": "api_segura"}
+            }
+        )
+        
+    else:
+        async_engine = create_async_engine(
+            database_url,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=settings.DEBUG
+        )
+    
+    return async_engine
+
 # Criação do engine
 engine = create_database_engine()
 
+# Engine assíncrono, criado apenas quando habilitado (exige aiosqlite/asyncpg)
+async_engine: Optional[AsyncEngine] = (
+    create_async_database_engine() if settings.ASYNC_DATABASE else None
+)
+
 
 # Criação da sessão com configurações otimizadas
 SessionLocal = sessionmaker(
@@ -94,6 +165,14 @@ SessionLocal = sessionmaker(
     expire_on_commit=False  # Mantém objetos válidos após commit
 )
 
+AsyncSessionLocal: Optional[async_sessionmaker] = (
+    async_sessionmaker(
+        bind=async_engine,
+        autoflush=False,
+        expire_on_commit=False
+    ) if async_engine is not None else None
+)
+
 def get_db() -> Generator[Session, None, None]:
     """
     Dependency para obter a sessão do banco de dados
@@ -113,6 +192,41 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency assíncrona para obter a sessão do banco de dados
+    Usada no lugar de get_db quando ASYNC_DATABASE=true
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Erro no banco de dados: {e}")
+            await db.rollback()
+            raise
+        except Exception as e:
+            logger.error(f"Erro inesperado: {e}")
+            await db.rollback()
+            raise
+
+# Dependency usada pelas rotas, selecionada pela configuração ASYNC_DATABASE
+session_dependency = get_async_db if settings.ASYNC_DATABASE else get_db
+
+async def run_db(db: Union[Session, AsyncSession], fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Executa uma função de crud.py com a sessão recebida
+    Com AsyncSession a função roda via run_sync, sem bloquear o event loop
+    em I/O de banco; com Session ela é chamada diretamente
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: fn(session, *args, **kwargs))
+    return fn(db, *args, **kwargs)
+
+async def dispose_async_engine() -> None:
+    """Fecha as conexões do engine assíncrono, se existir"""
+    if async_engine is not None:
+        await async_engine.dispose()
+
 @contextmanager
 def get_db_session() -> Generator[Session, None, None]:
     """
@@ -130,6 +244,24 @@ def get_db_session() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+def add_missing_columns(connection) -> None:
+    """
+    Adiciona (ALTER TABLE ... ADD COLUMN) colunas novas dos modelos em
+    tabelas que já existem; create_all só cria tabelas inteiras
+    Só serve para colunas anuláveis ou com server_default. Restrições de
+    tabelas existentes (ex.: ON DELETE CASCADE) não são alteradas.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                logger.info(f"Coluna {table.name}.{column.name} adicionada")
+
 def create_tables() -> bool:
     """
     Cria todas as tabelas no banco de dados
@@ -137,10 +269,18 @@ def create_tables() -> bool:
     """
     try:
         # Importa os modelos para garantir que estão registrados
-        from models import Base
+        from models import Base, DataItem, create_search_index
         
         # Cria as tabelas
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            add_missing_columns(connection)
+        # create_all não cria índices novos em tabelas que já existem
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        with engine.begin() as connection:
+            create_search_index(DataItem.__table__, connection)
         logger.info("Tabelas criadas com sucesso")
         return True
         
@@ -0,0 +1,42 @@
+"""
+Suporte a Idempotency-Key para a API Segura
+As respostas ficam na tabela idempotency_keys (crud.py); aqui ficam a
+impressão digital do corpo e a coalescência, no processo, de requisições
+simultâneas com a mesma chave
+"""
+
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+def request_fingerprint(body: bytes) -> str:
+    """sha256 do corpo, para detectar a mesma chave reutilizada com outro conteúdo"""
+    return hashlib.sha256(body).hexdigest()
+
+
+class KeyedLocks:
+    """
+    Um asyncio.Lock por chave, criado sob demanda e descartado quando não há
+    mais ninguém usando ou esperando
+
+    Requisições simultâneas com a mesma chave esperam a primeira terminar e
+    então encontram a resposta já guardada, em vez de criar outro item.
+    """
+
+    def __init__(self):
+        # chave -> [lock, requisições usando ou esperando]
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
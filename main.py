@@ -1,24 +1,46 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import re
+from typing import Any, Optional, Sequence, Union
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from pydantic import TypeAdapter, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import uvicorn
+from datetime import timedelta
+from functools import partial
 
 from config import settings
-from database import get_db, create_tables
+from database import session_dependency, get_db, run_db, create_tables, dispose_async_engine
 from models import (
     UserCreate, UserResponse, UserLogin, Token, 
-    DataItemCreate, DataItemUpdate, DataItemResponse
+    DataItemCreate, DataItemUpdate, DataItemResponse, DataItemFilters, DataItemSearchHit, PaginatedResponse,
+    DataItemBatchCreate, DataItemBatchResponse, DataItemImportResponse,
+    DataItemBulkSelection, DataItemBulkUpdate, DataItemBulkDelete, BulkOperationResponse,
+    UserStats, SystemStats, parse_data_item_fields
 )
 from auth import (
     authenticate_user, create_access_token, 
-    get_current_active_user, require_admin
+    get_current_active_user, require_admin,
+    get_password_hash_async, shutdown_password_executor,
+    build_token_claims, refresh_auth_versions
 )
 from crud import (
-    create_user, get_user_by_username, get_data_item,
-    create_data_item, get_data_items_by_user, get_all_data_items,
-    update_data_item, delete_data_item, can_access_data_item
+    create_user, get_user_by_username, get_user_by_id, get_data_item,
+    create_data_item, create_data_items, get_users_page, update_data_item, delete_data_item, data_item_exists,
+    data_item_conditions, bulk_update_data_items, bulk_delete_data_items, search_data_items,
+    get_counter, reconcile_counters, USERS_COUNTER, DATA_ITEMS_COUNTER,
+    record_login, get_user_stats, get_system_stats, data_item_columns,
+    get_data_item_rows, get_data_item_rows_page, iter_data_item_rows,
+    delete_user, soft_delete_user, purge_deleted_users, data_item_version,
+    get_idempotent_response, create_data_item_idempotent, purge_idempotency_keys,
+    sweep_expired_data_items, purge_user_auth_changes
 )
-from middleware import RateLimitMiddleware, LoggingMiddleware, SecurityMiddleware
+from middleware import APIMiddleware
+from rate_limit import create_rate_limiter
+from access_log import create_access_logger
+from tasks import start_periodic_task, stop_periodic_tasks
+from idempotency import KeyedLocks, request_fingerprint
+from streaming import EXPORT_MEDIA_TYPES, ndjson_chunks, csv_chunks, gzip_chunks, ndjson_lines
 
 # Configuração da aplicação
 app = FastAPI(
@@ -29,10 +51,15 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# Adiciona middlewares
-app.add_middleware(SecurityMiddleware)
-app.add_middleware(LoggingMiddleware)
-app.add_middleware(RateLimitMiddleware, requests_per_minute=60)
+# Adiciona middlewares (rate limit, log de acesso e headers de segurança em um só)
+rate_limiter = create_rate_limiter()
+access_logger = create_access_logger()
+app.add_middleware(
+    APIMiddleware,
+    requests_per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    limiter=rate_limiter,
+    access_logger=access_logger
+)
 
 # Configuração do CORS
 app.add_middleware(
@@ -48,6 +75,152 @@ app.add_middleware(
 async def startup_event():
     """Cria as tabelas do banco de dados na inicialização"""
     create_tables()
+    if settings.AUTH_CLAIMS_ONLY:
+        # Revogações e remoções feitas por outros workers (a primeira execução
+        # só marca o ponto de partida; ids novos são consultados no banco)
+        start_periodic_task(
+            "refresh_auth_versions", settings.AUTH_VERSION_REFRESH_INTERVAL, refresh_auth_versions
+        )
+    # Registros de revogação só servem enquanto os tokens afetados valem
+    token_lifetime = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    start_periodic_task(
+        "purge_user_auth_changes", token_lifetime.total_seconds(),
+        partial(purge_user_auth_changes, max_age=token_lifetime)
+    )
+    # Corrige divergências dos contadores de totais (a primeira execução é imediata)
+    start_periodic_task("reconcile_counters", settings.COUNTER_RECONCILE_INTERVAL, reconcile_counters)
+    # Remove em lotes os usuários excluídos logicamente
+    start_periodic_task(
+        "purge_deleted_users", settings.USER_PURGE_INTERVAL,
+        partial(purge_deleted_users, batch_size=settings.USER_PURGE_BATCH_SIZE)
+    )
+    start_periodic_task("purge_idempotency_keys", settings.IDEMPOTENCY_PURGE_INTERVAL, purge_idempotency_keys)
+    # Apaga em lotes os itens vencidos, que as leituras já escondem
+    start_periodic_task(
+        "sweep_expired_data_items", settings.EXPIRY_SWEEP_INTERVAL,
+        partial(sweep_expired_data_items, batch_size=settings.EXPIRY_SWEEP_BATCH_SIZE)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Encerra as tarefas periódicas e libera o executor de senhas, o log de acesso e o engine assíncrono"""
+    await stop_periodic_tasks()
+    shutdown_password_executor()
+    access_logger.flush()
+    await dispose_async_engine()
+
+def page_size(limit: int) -> int:
+    """Aplica o tamanho máximo de página configurado"""
+    return min(limit, settings.MAX_PAGE_SIZE)
+
+async def cursor_page(db, fn, limit: int, cursor: Optional[str], total: Optional[int] = None, **kwargs) -> dict:
+    """Executa uma listagem por cursor e monta o envelope PaginatedResponse"""
+    try:
+        items, next_cursor = await run_db(db, fn, limit=limit, cursor=cursor or None, **kwargs)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {
+        "items": items,
+        "total": total,
+        "skip": 0,
+        "limit": limit,
+        "has_next": next_cursor is not None,
+        "has_prev": bool(cursor),
+        "next_cursor": next_cursor
+    }
+
+# Serializador pré-construído para as listagens lidas como tuplas: gera o
+# JSON direto de dicts/datetimes, sem validar cada linha por um modelo
+json_serializer = TypeAdapter(Any)
+
+def rows_to_items(rows: Sequence, fields: Sequence[str]) -> list:
+    """Converte linhas (Row) em dicts só com os campos pedidos, na ordem da resposta"""
+    if not rows:
+        return []
+    positions = [(name, rows[0]._fields.index(name)) for name in fields]
+    return [{name: row[index] for name, index in positions} for row in rows]
+
+def json_response(content: Any) -> Response:
+    return Response(content=json_serializer.dump_json(content), media_type="application/json")
+
+def item_owner_scope(current_user: UserResponse) -> Optional[int]:
+    """Dono exigido nas operações por item (None para admins, que acessam todos)"""
+    return None if current_user.user_type == "admin" else current_user.id
+
+async def raise_item_not_accessible(db, item_id: int):
+    """Diferencia 404 de 403 quando a operação restrita ao dono não achou o item"""
+    if await run_db(db, data_item_exists, item_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso negado a este item de dados"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Item de dados não encontrado"
+    )
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+# Um elemento da lista do If-Match: W/ opcional e o valor entre aspas
+_ENTITY_TAG = re.compile(r'[\s,]*(W/)?"([^"]*)"\s*(?:,|$)')
+
+def if_match_versions(if_match: Optional[str]) -> Optional[list[int]]:
+    """
+    Versões aceitas pelo If-Match (None sem header ou com "*")
+    O header é uma lista de ETags separados por vírgula e a comparação é a
+    forte (RFC 9110 §13.1.1): ETags fracos ou que não são de uma versão nunca
+    conferem. Sem nenhuma versão aceita, ou com o header malformado, 412
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    position = 0
+    while position < len(if_match):
+        match = _ENTITY_TAG.match(if_match, position)
+        if match is None:
+            versions = []
+            break
+        weak, value = match.groups()
+        if not weak and value.isascii() and value.isdigit():
+            versions.append(int(value))
+        position = match.end()
+    if not versions:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="If-Match não confere com a versão atual do item"
+        )
+    return versions
+
+async def raise_item_write_failed(db, item_id: int, owner_id: Optional[int], expected_versions: Optional[list[int]]):
+    """Escrita condicional sem efeito: 412 se o item existe para o usuário, senão 404/403"""
+    if expected_versions is not None and await run_db(db, data_item_version, item_id, owner_id) is not None:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="If-Match não confere com a versão atual do item"
+        )
+    await raise_item_not_accessible(db, item_id)
+
+def bulk_conditions(selection: DataItemBulkSelection, current_user: UserResponse) -> list:
+    """Condições de uma operação em massa, sempre restritas ao dono para não admins"""
+    if selection.ids and len(selection.ids) > settings.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Máximo de {settings.MAX_BATCH_SIZE} ids por operação"
+        )
+    owner_id = item_owner_scope(current_user)
+    conditions = data_item_conditions(selection.filters, owner_id, selection.ids or None)
+    # Decide pelas condições de fato montadas: um filtro que não vira condição
+    # não restringe nada e a operação atingiria todos os itens
+    if len(conditions) == len(data_item_conditions(None, owner_id)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Informe ids ou filtros para a operação em massa"
+        )
+    return conditions
 
 # Rotas básicas
 @app.get("/")
@@ -75,11 +248,11 @@ async def health_check():
 
 # Rotas de autenticação
 @app.post("/login", response_model=Token, tags=["Autenticação"])
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin, db: Session = Depends(session_dependency)):
     """
     Endpoint de login que autentica o usuário e retorna um token JWT
     """
-    user = authenticate_user(db, user_credentials.username, user_credentials.password)
+    user = await authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,13 +267,9 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
         )
     
     # Cria o token de acesso
-    access_token = create_access_token(
-        data={
-            "sub": user.username,
-            "user_id": user.id,
-            "user_type": user.user_type
-        }
-    )
+    access_token = create_access_token(data=build_token_claims(user))
+    # Login conta como atividade do dia nas estatísticas
+    await run_db(db, record_login, user.id)
     
     return {
         "access_token": access_token,
@@ -109,20 +278,23 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     }
 
 @app.post("/register", response_model=UserResponse, tags=["Autenticação"])
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: Session = Depends(session_dependency)):
     """
     Endpoint para registro de novos usuários
     """
     # Verifica se o usuário já existe
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await run_db(db, get_user_by_username, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username já registrado"
         )
     
+    # O bcrypt roda no executor dedicado para não bloquear o event loop
+    hashed_password = await get_password_hash_async(user.password)
+    
     try:
-        return create_user(db=db, user=user)
+        return await run_db(db, create_user, user=user, hashed_password=hashed_password)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -130,133 +302,451 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
 
 # Rotas de dados (protegidas)
+# Requisições em andamento por (usuário, Idempotency-Key)
+idempotency_locks = KeyedLocks()
+
+def stored_response(stored, replayed: bool) -> Response:
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(
+        content=stored.response, status_code=stored.status_code,
+        media_type="application/json", headers=headers
+    )
+
 @app.post("/data", response_model=DataItemResponse, tags=["Dados"])
 async def create_data(
     data_item: DataItemCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     current_user: UserResponse = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Cria um novo item de dados (requer autenticação)
+
+    Com Idempotency-Key a resposta fica guardada por IDEMPOTENCY_TTL
+    segundos: retentativas com a mesma chave recebem a resposta original
+    (Idempotent-Replayed: true) sem criar outro item, e requisições
+    simultâneas com a mesma chave esperam a primeira. A mesma chave com
+    outro corpo retorna 422.
+    """
+    if idempotency_key is None:
+        return await run_db(db, create_data_item, data_item=data_item, user_id=current_user.id)
+    
+    request_hash = request_fingerprint(data_item.model_dump_json().encode())
+    async with idempotency_locks.hold((current_user.id, idempotency_key)):
+        stored = await run_db(db, get_idempotent_response, user_id=current_user.id, key=idempotency_key)
+        replayed = stored is not None
+        if not replayed:
+            # Se outro processo gravou a chave primeiro, volta a resposta dele
+            stored, created = await run_db(
+                db, create_data_item_idempotent, data_item=data_item, user_id=current_user.id,
+                key=idempotency_key, request_hash=request_hash, ttl=settings.IDEMPOTENCY_TTL
+            )
+            replayed = not created
+    
+    if stored is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Requisição com esta Idempotency-Key ainda em andamento"
+        )
+    if stored.request_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key já usada com outro corpo de requisição"
+        )
+    return stored_response(stored, replayed)
+
+@app.post("/data/batch", response_model=DataItemBatchResponse, tags=["Dados"])
+async def create_data_batch(
+    batch: DataItemBatchCreate,
+    atomic: bool = False,
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Cria vários itens de dados em uma única transação (requer autenticação)
+
+    Itens inválidos são reportados em `errors` e os válidos são criados;
+    com `atomic=true` qualquer erro rejeita o lote inteiro (422).
+    """
+    if len(batch.items) > settings.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Máximo de {settings.MAX_BATCH_SIZE} itens por lote"
+        )
+    
+    valid, positions, errors = [], [], []
+    for index, raw_item in enumerate(batch.items):
+        try:
+            valid.append(DataItemCreate.model_validate(raw_item))
+            positions.append(index)
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "errors": e.errors(include_url=False, include_context=False, include_input=False)
+            })
+    
+    if errors and atomic:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "Lote rejeitado: há itens inválidos", "errors": errors}
+        )
+    
+    ids = await run_db(db, create_data_items, data_items=valid, user_id=current_user.id) if valid else []
+    return {
+        "created": [{"index": index, "id": item_id} for index, item_id in zip(positions, ids)],
+        "errors": errors
+    }
+
+@app.post("/data/import", response_model=DataItemImportResponse, tags=["Dados"])
+async def import_data(
+    request: Request,
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Importa itens de um corpo NDJSON (um DataItemCreate por linha)
+
+    O corpo é lido em streaming e os itens válidos são gravados a cada
+    IMPORT_CHUNK_SIZE linhas, cada bloco em sua transação; enquanto um
+    bloco é gravado o corpo não é lido, então a memória fica limitada ao
+    bloco corrente. Linhas inválidas não interrompem a importação e são
+    reportadas pelo número da linha.
+    """
+    created, rejected, errors, pending = 0, 0, [], []
+    
+    def reject(line_number: int, line_errors: list):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < settings.IMPORT_MAX_ERRORS:
+            errors.append({"line": line_number, "errors": line_errors})
+    
+    async for line_number, line in ndjson_lines(request.stream(), settings.IMPORT_MAX_LINE_BYTES):
+        if line is None:
+            reject(line_number, [{
+                "type": "too_long", "loc": [],
+                "msg": f"Linha maior que {settings.IMPORT_MAX_LINE_BYTES} bytes"
+            }])
+            continue
+        try:
+            pending.append(DataItemCreate.model_validate_json(line))
+        except ValidationError as e:
+            reject(line_number, e.errors(include_url=False, include_context=False, include_input=False))
+            continue
+        if len(pending) >= settings.IMPORT_CHUNK_SIZE:
+            created += len(await run_db(db, create_data_items, data_items=pending, user_id=current_user.id))
+            pending = []
+    
+    if pending:
+        created += len(await run_db(db, create_data_items, data_items=pending, user_id=current_user.id))
+    return {"created": created, "rejected": rejected, "errors": errors}
+
+@app.patch("/data", response_model=BulkOperationResponse, tags=["Dados"])
+async def bulk_update_data(
+    bulk_update: DataItemBulkUpdate,
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Atualiza em um único comando os itens selecionados por ids e/ou filtros
+    (requer autenticação; usuários comuns só alteram os próprios itens)
+    """
+    conditions = bulk_conditions(bulk_update, current_user)
+    if not bulk_update.changes.model_dump(exclude_unset=True):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nenhum campo para alterar"
+        )
+    
+    affected = await run_db(
+        db, bulk_update_data_items, data_item=bulk_update.changes,
+        conditions=conditions, dry_run=bulk_update.dry_run
+    )
+    return {"affected": affected, "dry_run": bulk_update.dry_run}
+
+@app.delete("/data", response_model=BulkOperationResponse, tags=["Dados"])
+async def bulk_delete_data(
+    bulk_delete: DataItemBulkDelete,
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Deleta em um único comando os itens selecionados por ids e/ou filtros
+    (requer autenticação; usuários comuns só deletam os próprios itens)
     """
-    return create_data_item(db=db, data_item=data_item, user_id=current_user.id)
+    conditions = bulk_conditions(bulk_delete, current_user)
+    affected = await run_db(db, bulk_delete_data_items, conditions=conditions, dry_run=bulk_delete.dry_run)
+    return {"affected": affected, "dry_run": bulk_delete.dry_run}
 
-@app.get("/data", response_model=list[DataItemResponse], tags=["Dados"])
+@app.get(
+    "/data",
+    response_model=Union[PaginatedResponse[DataItemResponse], list[DataItemResponse]],
+    tags=["Dados"]
+)
 async def get_data(
-    skip: int = 0,
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula, ex.: title,created_at"),
+    excerpt: Optional[int] = Query(None, ge=1, le=10000, description="Corta content em N caracteres"),
+    filters: DataItemFilters = Depends(),
     current_user: UserResponse = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Lista os dados do usuário autenticado
+
+    Com `cursor` (vazio na primeira página) a listagem é por cursor, do mais
+    recente para o mais antigo, e a resposta é paginada com `next_cursor`;
+    sem ele mantém o modo por OFFSET (`skip`). Os filtros de DataItemFilters
+    são aplicados no banco nos dois modos.
+
+    A leitura é feita com select() Core e as linhas vão direto para o JSON,
+    sem objetos ORM nem revalidação pelo response_model. Com `fields` só as
+    colunas pedidas são lidas (mais o id); com `excerpt` o content já vem
+    cortado do banco.
     """
-    if current_user.user_type == "admin":
-        # Admins podem ver todos os dados
-        return get_all_data_items(db, skip=skip, limit=limit)
-    else:
-        # Usuários normais veem apenas seus próprios dados
-        return get_data_items_by_user(db, user_id=current_user.id, skip=skip, limit=limit)
+    limit = page_size(limit)
+    owner_id = item_owner_scope(current_user)
+    try:
+        selected = parse_data_item_fields(fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    columns = data_item_columns(selected, excerpt)
+    
+    if cursor is not None:
+        total = None
+        if not filters.model_dump(exclude_none=True):
+            # Sem filtros o total vem do contador mantido, sem COUNT(*)
+            total = await run_db(db, get_counter, DATA_ITEMS_COUNTER, owner_id or 0)
+        page = await cursor_page(
+            db, get_data_item_rows_page, limit, cursor, total=total, columns=columns, filters=filters, owner_id=owner_id
+        )
+        page["items"] = rows_to_items(page["items"], selected)
+        return json_response(page)
+    
+    # Admins veem todos os dados; usuários normais apenas os próprios
+    rows = await run_db(
+        db, get_data_item_rows, columns=columns, skip=skip, limit=limit, filters=filters, owner_id=owner_id
+    )
+    return json_response(rows_to_items(rows, selected))
+
+# Declarada antes de /data/{item_id} para que "search" não seja lido como id
+@app.get("/data/search", response_model=PaginatedResponse[DataItemSearchHit], tags=["Dados"])
+async def search_data(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1),
+    cursor: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Busca textual em título e conteúdo, ordenada por relevância (bm25 no
+    SQLite, ts_rank no PostgreSQL), com trechos destacados e paginação por
+    `next_cursor`; usuários comuns buscam apenas nos próprios itens
+    """
+    if not q.split():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Informe termos para a busca"
+        )
+    return await cursor_page(
+        db, search_data_items, page_size(limit), cursor,
+        query=q, owner_id=item_owner_scope(current_user)
+    )
+
+@app.get("/data/export", tags=["Dados"])
+async def export_data(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula, ex.: title,created_at"),
+    compress: bool = Query(False, description="Comprime a resposta com gzip"),
+    filters: DataItemFilters = Depends(),
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Exporta os itens (todos, para admins) em NDJSON ou CSV, em streaming
+
+    As linhas vêm de um cursor do lado do servidor em lotes de
+    EXPORT_BATCH_SIZE e são codificadas lote a lote, então a memória não
+    cresce com o número de itens. Usa sempre a sessão síncrona: o cursor
+    fica aberto enquanto a resposta é enviada.
+    """
+    try:
+        selected = parse_data_item_fields(fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    batches = iter_data_item_rows(
+        db, data_item_columns(selected), filters=filters,
+        owner_id=item_owner_scope(current_user), batch_size=settings.EXPORT_BATCH_SIZE
+    )
+    chunks = ndjson_chunks(batches, selected) if format == "ndjson" else csv_chunks(batches, selected)
+    headers = {"Content-Disposition": f'attachment; filename="data.{format}"'}
+    if compress:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
 
 @app.get("/data/{item_id}", response_model=DataItemResponse, tags=["Dados"])
 async def get_data_item_by_id(
     item_id: int,
+    response: Response,
     current_user: UserResponse = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Obtém um item de dados específico por ID (requer autenticação)
+    O ETag traz a versão do item, para uso no If-Match de PUT/DELETE
     """
-    # Verifica permissão de acesso
-    if not can_access_data_item(db, item_id, current_user.id, current_user.user_type):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Acesso negado a este item de dados"
-        )
-    
-    data_item = get_data_item(db, item_id=item_id)
+    data_item = await run_db(db, get_data_item, item_id=item_id, owner_id=item_owner_scope(current_user))
     if data_item is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item de dados não encontrado"
-        )
+        await raise_item_not_accessible(db, item_id)
     
+    response.headers["ETag"] = etag(data_item.version)
     return data_item
 
 @app.put("/data/{item_id}", response_model=DataItemResponse, tags=["Dados"])
 async def update_data_item_by_id(
     item_id: int,
     data_item_update: DataItemUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: UserResponse = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Atualiza um item de dados específico (requer autenticação)
+
+    Com If-Match só atualiza se a versão ainda for a do ETag; a checagem vai
+    no WHERE do próprio UPDATE e uma versão diferente retorna 412.
     """
-    # Verifica permissão de acesso
-    if not can_access_data_item(db, item_id, current_user.id, current_user.user_type):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Acesso negado a este item de dados"
-        )
-    
-    updated_item = update_data_item(db, item_id=item_id, data_item_update=data_item_update)
+    owner_id = item_owner_scope(current_user)
+    expected_versions = if_match_versions(if_match)
+    updated_item = await run_db(
+        db, update_data_item, item_id=item_id, data_item=data_item_update,
+        owner_id=owner_id, expected_versions=expected_versions
+    )
     if updated_item is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item de dados não encontrado"
-        )
+        await raise_item_write_failed(db, item_id, owner_id, expected_versions)
     
+    response.headers["ETag"] = etag(updated_item.version)
     return updated_item
 
 @app.delete("/data/{item_id}", tags=["Dados"])
 async def delete_data_item_by_id(
     item_id: int,
+    if_match: Optional[str] = Header(None),
     current_user: UserResponse = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Deleta um item de dados específico (requer autenticação)
+    Aceita If-Match como PUT /data/{item_id}
     """
-    # Verifica permissão de acesso
-    if not can_access_data_item(db, item_id, current_user.id, current_user.user_type):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Acesso negado a este item de dados"
-        )
-    
-    success = delete_data_item(db, item_id=item_id)
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item de dados não encontrado"
-        )
+    owner_id = item_owner_scope(current_user)
+    expected_versions = if_match_versions(if_match)
+    if not await run_db(
+        db, delete_data_item, item_id=item_id, owner_id=owner_id, expected_versions=expected_versions
+    ):
+        await raise_item_write_failed(db, item_id, owner_id, expected_versions)
     
     return {"message": "Item de dados deletado com sucesso"}
 
 # Rotas de usuários (apenas para admins)
-@app.get("/users", response_model=list[UserResponse], tags=["Usuários"])
+@app.get(
+    "/users",
+    response_model=Union[PaginatedResponse[UserResponse], list[UserResponse]],
+    tags=["Usuários"]
+)
 async def get_users(
-    skip: int = 0,
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
     current_user: UserResponse = Depends(require_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(session_dependency)
 ):
     """
     Lista todos os usuários (apenas para administradores)
+    Aceita `cursor` como GET /data
     """
+    limit = page_size(limit)
+    if cursor is not None:
+        total = await run_db(db, get_counter, USERS_COUNTER)
+        return await cursor_page(db, get_users_page, limit, cursor, total=total)
+    
     from crud import get_users as get_all_users
-    return get_all_users(db, skip=skip, limit=limit)
+    return await run_db(db, get_all_users, skip=skip, limit=limit)
+
+@app.delete("/users/{user_id}", tags=["Usuários"])
+async def delete_user_by_id(
+    user_id: int,
+    response: Response,
+    current_user: UserResponse = Depends(require_admin),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Remove um usuário e seus itens (apenas para administradores)
+
+    Os itens saem em um único DELETE antes do usuário. Usuários com
+    mais de USER_PURGE_THRESHOLD itens são desativados na hora (202) e
+    removidos em segundo plano, em lotes, sem travar o banco.
+    """
+    deferred = await run_db(db, get_counter, DATA_ITEMS_COUNTER, user_id) > settings.USER_PURGE_THRESHOLD
+    if not await run_db(db, soft_delete_user if deferred else delete_user, user_id=user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuário não encontrado"
+        )
+    
+    if deferred:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"message": "Usuário desativado; os dados serão removidos em segundo plano"}
+    return {"message": "Usuário deletado com sucesso"}
 
 @app.get("/me", response_model=UserResponse, tags=["Usuários"])
 async def get_current_user_info(
-    current_user: UserResponse = Depends(get_current_active_user)
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
 ):
     """
     Obtém informações do usuário autenticado
     """
+    if settings.AUTH_CLAIMS_ONLY:
+        # No modo por claims o usuário não foi carregado do banco
+        db_user = await run_db(db, get_user_by_id, current_user.id)
+        if db_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Usuário não encontrado"
+            )
+        return db_user
     return current_user
 
+@app.get("/me/stats", response_model=UserStats, tags=["Usuários"])
+async def get_current_user_stats(
+    current_user: UserResponse = Depends(get_current_active_user),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Estatísticas do usuário autenticado, lidas dos contadores e dos rollups diários
+    """
+    return await run_db(db, get_user_stats, current_user.id)
+
+@app.get("/stats", response_model=SystemStats, tags=["Usuários"])
+async def get_stats(
+    current_user: UserResponse = Depends(require_admin),
+    db: Session = Depends(session_dependency)
+):
+    """
+    Estatísticas do sistema (apenas para administradores)
+    """
+    return await run_db(db, get_system_stats)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
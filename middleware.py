@@ -1,75 +1,83 @@
+import math
 import time
-from collections import defaultdict
-from fastapi import Request, HTTPException
+from typing import Optional
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
 import logging
 
+from access_log import AccessLogger
+from rate_limit import MemoryRateLimiter, RateLimitBackend
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware para controle de taxa de requisições"""
+class APIMiddleware:
+    """
+    Middleware ASGI único com rate limit, tempo de processamento, log de
+    acesso e headers de segurança em uma só passada
+
+    ASGI puro: não cria tasks nem envolve o stream da resposta como o
+    BaseHTTPMiddleware, então respostas em streaming passam direto. O log
+    de acesso (uma linha JSON por requisição) vai para o AccessLogger, que
+    escreve em segundo plano.
+    """
     
-    def __init__(self, app, requests_per_minute: int = 60):
-        super().__init__(app)
-        self.requests_per_minute = requests_per_minute
-        self.requests = defaultdict(list)
+    # Headers de segurança já codificados para o ASGI
+    SECURITY_HEADERS = [
+        (b"x-content-type-options", b"nosniff"),
+        (b"x-frame-options", b"DENY"),
+        (b"x-xss-protection", b"1; mode=block"),
+        (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    ]
     
-    async def dispatch(self, request: Request, call_next):
-        client_ip = request.client.host
-        
-        current_time = time.time()
-        self.requests[client_ip] = [
-            req_time for req_time in self.requests[client_ip]
-            if current_time - req_time < 60
-        ]
-        
-        if len(self.requests[client_ip]) >= self.requests_per_minute:
-            return JSONResponse(
-                status_code=429,
-                content={
-                    "error": "Rate limit exceeded",
-                    "message": f"Máximo de {self.requests_per_minute} requisições por minuto excedido"
-                }
-            )
-        
-        self.requests[client_ip].append(current_time)
-        
-        response = await call_next(request)
-        return response
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware para logging de requisições"""
+    def __init__(self, app, requests_per_minute: int = 60, limiter: Optional[RateLimitBackend] = None,
+                 access_logger: Optional[AccessLogger] = None):
+        self.app = app
+        self.requests_per_minute = requests_per_minute
+        self.limiter = limiter if limiter is not None else MemoryRateLimiter(requests_per_minute)
+        self.access_logger = access_logger
     
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
-        logger.info(f"Requisição {request.method} {request.url.path} de {request.client.host}")
-        
-        response = await call_next(request)
-        
-        process_time = time.time() - start_time
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        logger.info(
-            f"Resposta {response.status_code} para {request.method} {request.url.path} "
-            f"em {process_time:.3f}s"
-        )
+        start_time = time.perf_counter()
+        client_ip = scope["client"][0] if scope.get("client") else "unknown"
+        status_code = 500
         
-        response.headers["X-Process-Time"] = str(process_time)
-        
-        return response
-
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """Middleware para headers de segurança"""
-    
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
+        result = await self.limiter.acquire(client_ip)
+        rate_limit_headers = [
+            (b"x-ratelimit-limit", str(result.limit).encode()),
+            (b"x-ratelimit-remaining", str(result.remaining).encode()),
+        ]
         
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        async def send_with_headers(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.extend(self.SECURITY_HEADERS)
+                headers.extend(rate_limit_headers)
+                headers.append((b"x-process-time", str(time.perf_counter() - start_time).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
         
-        return response
-        
\ No newline at end of file
+        try:
+            if not result.allowed:
+                response = JSONResponse(
+                    status_code=429,
+                    content={
+                        "error": "Rate limit exceeded",
+                        "message": f"Máximo de {self.requests_per_minute} requisições por minuto excedido"
+                    },
+                    headers={"Retry-After": str(math.ceil(result.retry_after))}
+                )
+                await response(scope, receive, send_with_headers)
+            else:
+                await self.app(scope, receive, send_with_headers)
+        finally:
+            if self.access_logger is not None:
+                self.access_logger.log(
+                    time.time(), scope["method"], scope["path"], status_code,
+                    time.perf_counter() - start_time, client_ip
+                )
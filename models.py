@@ -3,13 +3,13 @@ Modelos de dados para a API Segura
 Inclui modelos SQLAlchemy para banco de dados e Pydantic para validação da API
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, Boolean, ForeignKey, Index, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from pydantic import BaseModel, EmailStr, ConfigDict, Field, validator
-from typing import Optional, List
-from datetime import datetime
+from typing import Any, Dict, Generic, Optional, List, Tuple, TypeVar
+from datetime import datetime, timezone
 import re
 
 # Base declarativa para SQLAlchemy
@@ -31,13 +31,18 @@ class User(Base):
     # Status e tipo
     is_active = Column(Boolean, default=True, nullable=False)
     user_type = Column(String(20), default="user", nullable=False)  # user, admin, moderator
+    # Incrementado quando dados presentes no token mudam (revoga tokens antigos)
+    auth_version = Column(Integer, default=0, server_default="0", nullable=False)
+    # Exclusão lógica: o usuário e seus itens são removidos em segundo plano
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Relacionamentos
-    data_items = relationship("DataItem", back_populates="user", cascade="all, delete-orphan")
+    # Relacionamentos; os itens são removidos no banco (crud._delete_user_row
+    # e ON DELETE CASCADE), sem carregá-los na sessão
+    data_items = relationship("DataItem", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
     
     # Índices para performance
     __table_args__ = (
@@ -45,6 +50,14 @@ class User(Base):
         Index('idx_user_email', 'email'),
         Index('idx_user_type', 'user_type'),
         Index('idx_user_active', 'is_active'),
+        # Paginação por cursor em (created_at, id)
+        Index('idx_user_created_id', 'created_at', 'id'),
+        # Só os usuários aguardando remoção, para a purga em segundo plano
+        Index(
+            'idx_user_deleted_at', 'deleted_at',
+            sqlite_where=text('deleted_at IS NOT NULL'),
+            postgresql_where=text('deleted_at IS NOT NULL')
+        ),
     )
     
     def __repr__(self):
@@ -63,7 +76,12 @@ class DataItem(Base):
     content = Column(Text, nullable=False)
     
     # Relacionamento com usuário
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    
+    # Incrementada a cada alteração; base do ETag e do If-Match (concorrência otimista)
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+    # Opcional: vencido, o item some das leituras e é apagado pelo sweeper
+    expires_at = Column(DateTime(timezone=True), nullable=True)
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -74,15 +92,154 @@ class DataItem(Base):
     
     # Índices para performance
     __table_args__ = (
-        Index('idx_data_user_id', 'user_id'),
-        Index('idx_data_created_at', 'created_at'),
+        # Listagens, filtros de data e paginação por cursor: itens do usuário
+        # em ordem de (created_at, id); também atende consultas só por user_id
+        Index('idx_data_user_created_id', 'user_id', 'created_at', 'id'),
+        Index('idx_data_created_id', 'created_at', 'id'),
+        # Filtro por prefixo do título
         Index('idx_data_title', 'title'),
+        # Só itens com validade, para o sweeper de vencidos
+        Index(
+            'idx_data_expires_at', 'expires_at',
+            sqlite_where=text('expires_at IS NOT NULL'),
+            postgresql_where=text('expires_at IS NOT NULL')
+        ),
     )
     
     def __repr__(self):
         return f"<DataItem(id={self.id}, title='{self.title}', user_id={self.user_id})>"
 
 
+class Counter(Base):
+    """
+    Contadores mantidos pelas operações de escrita em crud.py
+    Evitam COUNT(*) sobre tabelas grandes; user_id=0 guarda o total global.
+    Um job periódico recalcula os valores para corrigir divergências.
+    """
+    __tablename__ = "counters"
+    
+    name = Column(String(50), primary_key=True)
+    user_id = Column(Integer, primary_key=True, default=0)
+    value = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<Counter(name='{self.name}', user_id={self.user_id}, value={self.value})>"
+
+class IdempotencyKey(Base):
+    """
+    Resposta guardada de um POST /data com Idempotency-Key
+    Uma retentativa com a mesma chave recebe a resposta original em vez de
+    criar outro item; a linha vale até expires_at e depois é apagada
+    """
+    __tablename__ = "idempotency_keys"
+    
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # sha256 do corpo: a mesma chave com outro corpo é rejeitada
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class UserAuthChange(Base):
+    """
+    Revogação de tokens (auth_version incrementada) ou remoção de um usuário
+    No modo AUTH_CLAIMS_ONLY cada worker lê só as linhas gravadas desde a
+    última recarga para atualizar a tabela de versões em memória. Sem FK:
+    a linha precisa sobreviver à remoção do usuário; depois da validade dos
+    tokens ela não serve mais e é apagada
+    """
+    __tablename__ = "user_auth_changes"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    auth_version = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class DailyUserActivity(Base):
+    """
+    Rollup diário por usuário (dia em UTC), atualizado nas escritas
+    Uma linha por usuário ativo no dia: itens criados e hora da última atividade
+    """
+    __tablename__ = "daily_user_activity"
+    
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    items_created = Column(Integer, nullable=False, default=0)
+    last_activity_at = Column(DateTime(timezone=True), nullable=False)
+
+class DailySystemStats(Base):
+    """
+    Rollup diário do sistema (dia em UTC): usuários ativos e itens criados
+    """
+    __tablename__ = "daily_system_stats"
+    
+    day = Column(Date, primary_key=True)
+    active_users = Column(Integer, nullable=False, default=0)
+    items_created = Column(Integer, nullable=False, default=0)
+
+# Busca textual: no SQLite uma tabela FTS5 de conteúdo externo espelha
+# data_items (mantida por triggers); no PostgreSQL um índice GIN sobre o
+# tsvector de título + conteúdo
+SQLITE_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS data_items_fts USING fts5(
+        title, content, content='data_items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS data_items_fts_ai AFTER INSERT ON data_items BEGIN
+        INSERT INTO data_items_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS data_items_fts_ad AFTER DELETE ON data_items BEGIN
+        INSERT INTO data_items_fts(data_items_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS data_items_fts_au AFTER UPDATE OF title, content ON data_items BEGIN
+        INSERT INTO data_items_fts(data_items_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO data_items_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+# Expressão indexada; a consulta de busca precisa usar exatamente a mesma
+POSTGRES_SEARCH_VECTOR = "to_tsvector('simple', title || ' ' || content)"
+
+def create_search_index(target, connection, **kw):
+    """
+    Cria as estruturas de busca textual de data_items
+    Executado após a criação da tabela e por create_tables em bancos já
+    existentes; no SQLite indexa as linhas que já existiam
+    """
+    if connection.dialect.name == "sqlite":
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_items_fts'"
+        ).first()
+        for statement in SQLITE_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            connection.exec_driver_sql("INSERT INTO data_items_fts(data_items_fts) VALUES ('rebuild')")
+    elif connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS idx_data_search ON data_items USING GIN ({POSTGRES_SEARCH_VECTOR})"
+        )
+
+def drop_search_index(target, connection, **kw):
+    """Remove a tabela FTS5 junto com data_items (os triggers caem com a tabela)"""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS data_items_fts")
+
+event.listen(DataItem.__table__, "after_create", create_search_index)
+event.listen(DataItem.__table__, "after_drop", drop_search_index)
+
+
 class UserBase(BaseModel):
     """
     Modelo base para usuários
@@ -190,12 +347,21 @@ class TokenData(BaseModel):
     user_type: Optional[str] = None
     exp: Optional[int] = None
 
+def normalize_expires_at(v: Optional[datetime]) -> Optional[datetime]:
+    """Validade em UTC e sem microssegundos, no formato em que o banco compara datas"""
+    if v is None:
+        return v
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc)
+    return v.replace(tzinfo=timezone.utc, microsecond=0)
+
 class DataItemBase(BaseModel):
     """
     Modelo base para itens de dados
     """
     title: str = Field(..., min_length=1, max_length=200, description="Título do item")
     content: str = Field(..., min_length=1, description="Conteúdo do item")
+    expires_at: Optional[datetime] = Field(None, description="Validade do item (UTC se sem fuso)")
     
     @validator('title')
     def validate_title(cls, v):
@@ -210,12 +376,22 @@ class DataItemBase(BaseModel):
         if not v.strip():
             raise ValueError('Conteúdo não pode estar vazio')
         return v.strip()
+    
+    @validator('expires_at')
+    def validate_expires_at(cls, v):
+        return normalize_expires_at(v)
 
 class DataItemCreate(DataItemBase):
     """
     Modelo para criação de item de dados
     """
-    pass
+    
+    @validator('expires_at')
+    def validate_future_expires_at(cls, v):
+        # Um item já vencido sairia escondido, mas contado até o sweeper passar
+        if v is not None and normalize_expires_at(v) <= datetime.now(timezone.utc):
+            raise ValueError('Validade deve estar no futuro')
+        return v
 
 class DataItemUpdate(BaseModel):
     """
@@ -224,22 +400,29 @@ class DataItemUpdate(BaseModel):
     """
     title: Optional[str] = Field(None, min_length=1, max_length=200)
     content: Optional[str] = Field(None, min_length=1)
+    expires_at: Optional[datetime] = Field(None, description="Nova validade; null remove a validade")
+    
+    @validator('expires_at')
+    def validate_expires_at(cls, v):
+        return normalize_expires_at(v)
     
+    # Só rodam para campos enviados: omitir mantém o valor, mas null explícito
+    # chegaria ao UPDATE de colunas NOT NULL
     @validator('title')
     def validate_title(cls, v):
-        if v is not None:
-            if not v.strip():
-                raise ValueError('Título não pode estar vazio')
-            return v.strip()
-        return v
+        if v is None:
+            raise ValueError('Título não pode ser nulo')
+        if not v.strip():
+            raise ValueError('Título não pode estar vazio')
+        return v.strip()
     
     @validator('content')
     def validate_content(cls, v):
-        if v is not None:
-            if not v.strip():
-                raise ValueError('Conteúdo não pode estar vazio')
-            return v.strip()
-        return v
+        if v is None:
+            raise ValueError('Conteúdo não pode ser nulo')
+        if not v.strip():
+            raise ValueError('Conteúdo não pode estar vazio')
+        return v.strip()
 
 class DataItemResponse(DataItemBase):
     """
@@ -248,11 +431,83 @@ class DataItemResponse(DataItemBase):
     """
     id: int = Field(..., description="ID único do item")
     user_id: int = Field(..., description="ID do usuário proprietário")
+    version: int = Field(..., description="Versão do item, usada no ETag")
     created_at: datetime = Field(..., description="Data de criação")
     updated_at: Optional[datetime] = Field(None, description="Data da última atualização")
     
     model_config = ConfigDict(from_attributes=True)
 
+# Campos de DataItemResponse que podem ser pedidos em `fields=`, na ordem da resposta
+DATA_ITEM_FIELDS: Tuple[str, ...] = tuple(DataItemResponse.model_fields)
+
+def parse_data_item_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """
+    Converte "title,created_at" nos campos pedidos, na ordem canônica
+    O id sempre é incluído; campos desconhecidos geram ValueError
+    """
+    if not fields:
+        return DATA_ITEM_FIELDS
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(DATA_ITEM_FIELDS)
+    if unknown:
+        raise ValueError(f"Campos desconhecidos: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return tuple(name for name in DATA_ITEM_FIELDS if name in requested)
+
+class DataItemSearchHit(DataItemResponse):
+    """
+    Resultado da busca textual
+    Os trechos destacados marcam os termos com <mark>; o texto não é
+    escapado e deve ser tratado como conteúdo do usuário
+    """
+    rank: float = Field(..., description="Relevância (menor é melhor)")
+    title_highlight: str = Field(..., description="Título com os termos destacados")
+    snippet: str = Field(..., description="Trecho do conteúdo com os termos destacados")
+
+class DataItemBatchCreate(BaseModel):
+    """
+    Modelo para criação de itens em lote
+    Cada item é validado individualmente como DataItemCreate na rota, para
+    que erros em um item não invalidem o lote inteiro
+    """
+    items: List[Dict[str, Any]] = Field(..., min_length=1, description="Itens a criar")
+
+class DataItemBatchCreated(BaseModel):
+    """
+    Item criado em um lote
+    """
+    index: int = Field(..., description="Posição do item no lote")
+    id: int = Field(..., description="ID do item criado")
+
+class DataItemBatchError(BaseModel):
+    """
+    Erro de validação de um item do lote
+    """
+    index: int = Field(..., description="Posição do item no lote")
+    errors: List[dict] = Field(..., description="Erros por campo")
+
+class DataItemBatchResponse(BaseModel):
+    """
+    Resposta da criação em lote
+    """
+    created: List[DataItemBatchCreated] = Field(..., description="Itens criados")
+    errors: List[DataItemBatchError] = Field(..., description="Itens rejeitados")
+
+class DataItemImportError(BaseModel):
+    """
+    Erro em uma linha da importação NDJSON
+    """
+    line: int = Field(..., description="Número da linha no corpo (a partir de 1)")
+    errors: List[dict] = Field(..., description="Erros por campo")
+
+class DataItemImportResponse(BaseModel):
+    """
+    Resumo da importação NDJSON
+    """
+    created: int = Field(..., description="Itens criados")
+    rejected: int = Field(..., description="Linhas rejeitadas")
+    errors: List[DataItemImportError] = Field(..., description="Erros das primeiras linhas rejeitadas")
+
 
 class PaginationParams(BaseModel):
     """
@@ -265,21 +520,54 @@ class DataItemFilters(BaseModel):
     """
     Filtros para busca de itens de dados
     """
-    title_contains: Optional[str] = Field(None, description="Título contém")
+    title_contains: Optional[str] = Field(None, min_length=1, description="Título contém")
+    title_prefix: Optional[str] = Field(None, min_length=1, description="Título começa com")
     user_id: Optional[int] = Field(None, description="ID do usuário")
     created_after: Optional[datetime] = Field(None, description="Criado após")
     created_before: Optional[datetime] = Field(None, description="Criado antes")
 
-class PaginatedResponse(BaseModel):
+class DataItemBulkSelection(BaseModel):
+    """
+    Seleção de itens para operações em massa: lista de ids e/ou filtros
+    """
+    ids: Optional[List[int]] = Field(None, description="IDs dos itens")
+    filters: Optional[DataItemFilters] = Field(None, description="Filtros dos itens")
+    dry_run: bool = Field(default=False, description="Apenas conta os itens afetados")
+
+class DataItemBulkUpdate(DataItemBulkSelection):
+    """
+    Modelo para atualização em massa de itens de dados
+    """
+    changes: DataItemUpdate = Field(..., description="Campos a alterar")
+
+class DataItemBulkDelete(DataItemBulkSelection):
+    """
+    Modelo para exclusão em massa de itens de dados
+    """
+    pass
+
+class BulkOperationResponse(BaseModel):
+    """
+    Resposta de operações em massa
+    """
+    affected: int = Field(..., description="Itens afetados (ou que seriam, em dry_run)")
+    dry_run: bool = Field(..., description="Se a operação foi apenas simulada")
+
+ItemT = TypeVar("ItemT")
+
+class PaginatedResponse(BaseModel, Generic[ItemT]):
     """
     Resposta paginada genérica
+    Na paginação por cursor `total` não é calculado e a próxima página é
+    pedida com `next_cursor`
     """
-    items: List[DataItemResponse] = Field(..., description="Lista de itens")
-    total: int = Field(..., description="Total de itens")
-    skip: int = Field(..., description="Itens pulados")
+    items: List[ItemT] = Field(..., description="Lista de itens")
+    total: Optional[int] = Field(None, description="Total de itens")
+    skip: int = Field(default=0, description="Itens pulados")
     limit: int = Field(..., description="Limite de itens")
     has_next: bool = Field(..., description="Tem próxima página")
-    has_prev: bool = Field(..., description="Tem página anterior")
+    has_prev: bool = Field(default=False, description="Tem página anterior")
+    next_cursor: Optional[str] = Field(None, description="Cursor da próxima página")
 
 class ErrorResponse(BaseModel):
     """
@@ -0,0 +1,444 @@
+"""
+Controle de taxa de requisições para a API Segura
+Implementa GCRA (Generic Cell Rate Algorithm), equivalente a um token bucket,
+guardando um único float por chave
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitResult(NamedTuple):
+    """Resultado de uma verificação de taxa"""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # Segundos até a próxima requisição ser aceita
+
+
+class RateLimitBackend(ABC):
+    """Interface dos backends usados pelo APIMiddleware"""
+
+    @abstractmethod
+    async def acquire(self, key: str) -> RateLimitResult:
+        """Registra uma requisição da chave e informa se ela é permitida"""
+
+    @abstractmethod
+    def reset(self) -> None:
+        """Descarta o estado de todas as chaves"""
+
+
+class MemoryRateLimiter(RateLimitBackend):
+    """
+    Limitador GCRA em memória com número máximo de chaves
+
+    Para cada chave guarda apenas o TAT (theoretical arrival time). Cada
+    requisição custa O(1); chaves ociosas saem por LRU quando o limite de
+    chaves é atingido, então a memória não cresce com o número de clientes.
+    """
+
+    def __init__(self, requests_per_minute: int = 60, burst: Optional[int] = None, max_keys: int = 10000):
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst or requests_per_minute
+        self.max_keys = max_keys
+        # Intervalo entre requisições e tolerância equivalente ao burst
+        self.emission_interval = 60.0 / requests_per_minute
+        self.tolerance = self.emission_interval * self.burst
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, now: Optional[float] = None) -> RateLimitResult:
+        """Registra uma requisição da chave e informa se ela é permitida"""
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            tat = max(self._tat.get(key, now), now)
+            new_tat = tat + self.emission_interval
+            allow_at = new_tat - self.tolerance
+
+            if now < allow_at:
+                if key in self._tat:
+                    self._tat.move_to_end(key)
+                return RateLimitResult(False, self.burst, 0, allow_at - now)
+
+            self._tat[key] = new_tat
+            self._tat.move_to_end(key)
+            while len(self._tat) > self.max_keys:
+                self._tat.popitem(last=False)
+
+        remaining = int((now - allow_at) / self.emission_interval + 1e-9)
+        return RateLimitResult(True, self.burst, remaining, 0.0)
+
+    async def acquire(self, key: str) -> RateLimitResult:
+        return self.hit(key)
+
+    def reset(self) -> None:
+        """Descarta o estado de todas as chaves"""
+        with self._lock:
+            self._tat.clear()
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class SharedMemoryRateLimiter(RateLimitBackend):
+    """
+    Limitador GCRA compartilhado entre processos (workers do uvicorn)
+
+    O estado fica em uma tabela hash de slots fixos em um arquivo mapeado com
+    mmap (por padrão em /dev/shm). A chave cai em um bucket de
+    SLOTS_PER_BUCKET slots; cada slot guarda (hash da chave, TAT). A
+    atualização de um bucket é atômica via lock de intervalo de bytes
+    (fcntl.lockf) sobre o próprio bucket, então workers só disputam quando
+    acessam o mesmo bucket. Chave nova ocupa o slot de menor TAT do bucket:
+    vazio, vencido (equivale a uma chave nova) ou, com o bucket cheio, o mais
+    antigo.
+    """
+
+    MAGIC = b"GCRA0001"
+    HEADER = struct.Struct("<8sQ")
+    HEADER_SIZE = 64
+    SLOTS_PER_BUCKET = 8
+    BUCKET = struct.Struct("<" + "Qd" * SLOTS_PER_BUCKET)
+    SLOT = struct.Struct("<Qd")
+
+    def __init__(self, path: str, requests_per_minute: int = 60, burst: Optional[int] = None, max_keys: int = 10000):
+        self.path = path
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst or requests_per_minute
+        self.emission_interval = 60.0 / requests_per_minute
+        self.tolerance = self.emission_interval * self.burst
+        self.buckets = max(1, math.ceil(max_keys / self.SLOTS_PER_BUCKET))
+        self.size = self.HEADER_SIZE + self.buckets * self.BUCKET.size
+        # Locks fcntl são por processo: threads do mesmo worker usam este lock
+        self._lock = threading.Lock()
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            if (
+                os.fstat(self._fd).st_size != self.size
+                or header != self.HEADER.pack(self.MAGIC, self.buckets)
+            ):
+                # Arquivo novo ou com outro layout: recria a tabela zerada
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.buckets), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    @staticmethod
+    def _hash_key(key: str) -> int:
+        # hash() do Python muda entre processos; dois crc32 formam um hash
+        # estável de 64 bits (0 fica reservado para slot vazio)
+        data = key.encode()
+        return (zlib.crc32(data) | zlib.crc32(data, 0x9E3779B9) << 32) or 1
+
+    def hit(self, key: str, now: Optional[float] = None) -> RateLimitResult:
+        """Registra uma requisição da chave e informa se ela é permitida"""
+        if now is None:
+            # Relógio de parede: o arquivo pode sobreviver a reinícios
+            now = time.time()
+
+        key_hash = self._hash_key(key)
+        offset = self.HEADER_SIZE + (key_hash % self.buckets) * self.BUCKET.size
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.BUCKET.size, offset)
+            try:
+                slots = self.BUCKET.unpack_from(self._mm, offset)
+                hashes, tats = slots[0::2], slots[1::2]
+                if key_hash in hashes:
+                    target = hashes.index(key_hash)
+                    stored_tat = tats[target]
+                else:
+                    # Menor TAT: slot vazio (0), vencido ou, no pior caso, o mais antigo
+                    target = tats.index(min(tats))
+                    stored_tat = now
+
+                tat = max(stored_tat, now)
+                new_tat = tat + self.emission_interval
+                allow_at = new_tat - self.tolerance
+                if now < allow_at:
+                    return RateLimitResult(False, self.burst, 0, allow_at - now)
+
+                self.SLOT.pack_into(self._mm, offset + target * self.SLOT.size, key_hash, new_tat)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.BUCKET.size, offset)
+
+        remaining = int((now - allow_at) / self.emission_interval + 1e-9)
+        return RateLimitResult(True, self.burst, remaining, 0.0)
+
+    async def acquire(self, key: str) -> RateLimitResult:
+        return self.hit(key)
+
+    def reset(self) -> None:
+        """Descarta o estado de todas as chaves"""
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._mm[self.HEADER_SIZE:] = bytes(self.size - self.HEADER_SIZE)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+class RedisError(Exception):
+    """Erro retornado pelo servidor Redis"""
+
+
+class RespClient:
+    """
+    Cliente mínimo do protocolo Redis (RESP2) sobre asyncio
+
+    Uma conexão com um comando por vez; reconecta na próxima chamada
+    após qualquer erro de I/O.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _encode(args: Tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Conexão com Redis encerrada")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Resposta RESP inválida: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send(("AUTH", self.password))
+        if self.db:
+            await self._send(("SELECT", self.db))
+
+    async def _send(self, args: Tuple):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def execute(self, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                return await self._send(args)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                # Estado do stream desconhecido (inclusive após timeout): descarta
+                await self.close()
+                raise
+
+    async def close(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+
+
+class RedisRateLimiter(RateLimitBackend):
+    """
+    Limitador GCRA distribuído, com estado em um servidor Redis
+
+    Um script Lua reserva atomicamente até `batch_size` requisições por vez
+    usando o relógio do Redis (TIME), então todos os nós disputam o mesmo
+    orçamento. As reservas ficam em um lease local e as requisições seguintes
+    da chave são atendidas sem ida ao Redis. Negativas também são guardadas
+    até o Retry-After.
+
+    Se o Redis falha ou demora mais que `timeout`, a requisição é decidida
+    pelo limitador local `fallback` e o Redis é ignorado por
+    `cooldown` segundos.
+    """
+
+    # Retorna {concedidas, restante}; sem concessão, {0, retry_after}
+    SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local granted = math.floor((now + tolerance - tat) / interval + 1e-9)
+if granted > wanted then granted = wanted end
+if granted <= 0 then
+  return {0, tostring(tat + interval - tolerance - now)}
+end
+local new_tat = tat + granted * interval
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {granted, tostring(math.floor((now + tolerance - new_tat) / interval + 1e-9))}
+"""
+    SCRIPT_SHA = hashlib.sha1(SCRIPT.encode()).hexdigest()
+
+    # Tempo máximo que requisições reservadas ficam guardadas no nó
+    LEASE_SECONDS = 1.0
+
+    def __init__(
+        self,
+        url: str,
+        requests_per_minute: int = 60,
+        burst: Optional[int] = None,
+        batch_size: int = 5,
+        timeout: float = 0.05,
+        cooldown: float = 5.0,
+        fallback: Optional[RateLimitBackend] = None,
+        max_keys: int = 10000,
+        prefix: str = "ratelimit:"
+    ):
+        self.client = RespClient(url)
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst or requests_per_minute
+        self.emission_interval = 60.0 / requests_per_minute
+        self.tolerance = self.emission_interval * self.burst
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.fallback = fallback if fallback is not None else MemoryRateLimiter(requests_per_minute, burst, max_keys)
+        self.max_keys = max_keys
+        self.prefix = prefix
+        # chave -> [reservadas, restante no Redis, expiração, negado até]
+        self._leases: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._redis_down_until = 0.0
+
+    async def _reserve(self, key: str) -> Tuple[int, float]:
+        args = (self.prefix + key, repr(self.emission_interval), repr(self.tolerance), self.batch_size)
+        try:
+            reply = await self.client.execute("EVALSHA", self.SCRIPT_SHA, 1, *args)
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            reply = await self.client.execute("EVAL", self.SCRIPT, 1, *args)
+        return int(reply[0]), float(reply[1])
+
+    async def acquire(self, key: str) -> RateLimitResult:
+        now = time.monotonic()
+        lease = self._leases.get(key)
+        if lease is not None:
+            self._leases.move_to_end(key)
+            if lease[3] > now:
+                return RateLimitResult(False, self.burst, 0, lease[3] - now)
+            if lease[0] > 0 and lease[2] > now:
+                lease[0] -= 1
+                return RateLimitResult(True, self.burst, int(lease[0] + lease[1]), 0.0)
+
+        if now < self._redis_down_until:
+            return await self.fallback.acquire(key)
+
+        try:
+            granted, value = await asyncio.wait_for(self._reserve(key), self.timeout)
+        except (asyncio.TimeoutError, OSError, ConnectionError, RedisError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Rate limit distribuído indisponível, usando limite local: {e!r}")
+            self._redis_down_until = now + self.cooldown
+            return await self.fallback.acquire(key)
+
+        if granted == 0:
+            self._store_lease(key, [0, 0, now, now + value])
+            return RateLimitResult(False, self.burst, 0, value)
+
+        self._store_lease(key, [granted - 1, value, now + self.LEASE_SECONDS, 0.0])
+        return RateLimitResult(True, self.burst, int(granted - 1 + value), 0.0)
+
+    def _store_lease(self, key: str, lease: List[float]) -> None:
+        self._leases[key] = lease
+        self._leases.move_to_end(key)
+        while len(self._leases) > self.max_keys:
+            self._leases.popitem(last=False)
+
+    def reset(self) -> None:
+        """Descarta as reservas locais (o estado no Redis expira sozinho)"""
+        self._leases.clear()
+        self._redis_down_until = 0.0
+        self.fallback.reset()
+
+
+def default_shm_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "api_segura_ratelimit")
+
+
+def create_rate_limiter() -> RateLimitBackend:
+    """
+    Cria o limitador conforme RATE_LIMIT_BACKEND
+    memory: estado por processo; shm: compartilhado entre workers locais;
+    redis: compartilhado entre nós, com fallback local
+    """
+    options = dict(
+        requests_per_minute=settings.RATE_LIMIT_PER_MINUTE,
+        burst=settings.RATE_LIMIT_BURST,
+        max_keys=settings.RATE_LIMIT_MAX_KEYS
+    )
+    if settings.RATE_LIMIT_BACKEND == "shm":
+        return SharedMemoryRateLimiter(settings.RATE_LIMIT_SHM_PATH or default_shm_path(), **options)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        # No fallback cada nó fica com sua parte do orçamento global
+        nodes = max(settings.RATE_LIMIT_NODES, 1)
+        fallback = MemoryRateLimiter(
+            requests_per_minute=max(settings.RATE_LIMIT_PER_MINUTE // nodes, 1),
+            burst=max(settings.RATE_LIMIT_BURST // nodes, 1),
+            max_keys=settings.RATE_LIMIT_MAX_KEYS
+        )
+        return RedisRateLimiter(
+            settings.RATE_LIMIT_REDIS_URL,
+            batch_size=settings.RATE_LIMIT_REDIS_BATCH,
+            timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+            fallback=fallback,
+            **options
+        )
+    return MemoryRateLimiter(**options)
@@ -0,0 +1,117 @@
+"""
+Codificação em streaming para exportação e importação de dados da API Segura
+Converte lotes de linhas (Row) em NDJSON ou CSV, com gzip opcional, e
+separa um corpo NDJSON em linhas à medida que ele chega, sem montar o
+arquivo inteiro em memória
+"""
+
+import csv
+import io
+import zlib
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Sequence, Tuple
+
+from pydantic import TypeAdapter
+
+# Serializa dicts com datetimes sem validação por linha
+_json = TypeAdapter(Any)
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _positions(batch: Sequence, fields: Sequence[str]) -> list:
+    return [(name, batch[0]._fields.index(name)) for name in fields]
+
+
+def ndjson_chunks(batches: Iterable[Sequence], fields: Sequence[str]) -> Iterator[bytes]:
+    """Um objeto JSON por linha; um chunk por lote lido do banco"""
+    for batch in batches:
+        if not batch:
+            continue
+        positions = _positions(batch, fields)
+        yield b"".join(
+            _json.dump_json({name: row[index] for name, index in positions}) + b"\n"
+            for row in batch
+        )
+
+
+def csv_chunks(batches: Iterable[Sequence], fields: Sequence[str]) -> Iterator[bytes]:
+    """Cabeçalho com os campos e uma linha por item; datas em ISO 8601"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for batch in batches:
+        if not batch:
+            continue
+        positions = _positions(batch, fields)
+        for row in batch:
+            writer.writerow([
+                value.isoformat() if hasattr(value, "isoformat") else value
+                for value in (row[index] for _, index in positions)
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Sem itens o cabeçalho ainda sai
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Comprime os chunks em um único stream gzip, à medida que chegam"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def ndjson_lines(
+    chunks: AsyncIterable[bytes], max_line_bytes: int
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Separa o corpo em linhas (número, bytes) conforme os chunks chegam
+    Linhas em branco são puladas; uma linha maior que `max_line_bytes` é
+    descartada até o próximo "\\n" e sai como (número, None), então o buffer
+    nunca passa desse tamanho
+    """
+    buffer = bytearray()
+    oversized = False
+    line_number = 0
+
+    def take() -> Optional[Tuple[int, Optional[bytes]]]:
+        nonlocal oversized
+        line = None if oversized else bytes(buffer)
+        buffer.clear()
+        oversized = False
+        if line is not None and not line.strip():
+            return None
+        return line_number, line
+
+    async for chunk in chunks:
+        start = 0
+        while start <= len(chunk):
+            end = chunk.find(b"\n", start)
+            piece = chunk[start:] if end == -1 else chunk[start:end]
+            if not oversized:
+                buffer += piece
+                if len(buffer) > max_line_bytes:
+                    oversized = True
+                    buffer.clear()
+            if end == -1:
+                break
+            line_number += 1
+            line = take()
+            if line is not None:
+                yield line
+            start = end + 1
+
+    # Última linha sem quebra no final
+    if oversized or buffer:
+        line_number += 1
+        line = take()
+        if line is not None:
+            yield line
@@ -0,0 +1,48 @@
+"""
+Tarefas periódicas em segundo plano para a API Segura
+Cada execução roda em uma thread com a própria sessão de banco, sem
+bloquear o event loop
+"""
+
+import asyncio
+import logging
+from typing import Callable, List
+
+from sqlalchemy.orm import Session
+
+from database import get_db_session
+
+logger = logging.getLogger(__name__)
+
+_tasks: List[asyncio.Task] = []
+
+
+def _run_job(job: Callable[[Session], None]) -> None:
+    with get_db_session() as db:
+        job(db)
+
+
+async def _run_periodically(name: str, interval: float, job: Callable[[Session], None]) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(_run_job, job)
+            logger.debug(f"Tarefa {name} executada")
+        except Exception as e:
+            # Uma falha não interrompe as próximas execuções
+            logger.error(f"Erro na tarefa {name}: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_periodic_task(name: str, interval: float, job: Callable[[Session], None]) -> None:
+    """Agenda `job(db)` a cada `interval` segundos, começando imediatamente"""
+    if interval <= 0:
+        return
+    _tasks.append(asyncio.create_task(_run_periodically(name, interval, job), name=name))
+
+
+async def stop_periodic_tasks() -> None:
+    """Cancela as tarefas agendadas e aguarda o encerramento"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
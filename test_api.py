@@ -1,12 +1,12 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
-from main import app
+from main import app, rate_limiter
 from database import get_db, Base
-from models import User, DataItem
+from models import User, DataItem, UserResponse
 from auth import get_password_hash
 
 # Configuração do banco de dados de teste
@@ -19,6 +19,11 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+@event.listens_for(engine, "connect")
+def enable_foreign_keys(dbapi_connection, connection_record):
+    """Como em produção: ON DELETE CASCADE exige foreign keys ativas no SQLite"""
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
 def override_get_db():
     """Override da função get_db para testes"""
     try:
@@ -35,6 +40,8 @@ def client():
     """Cliente de teste"""
     # Cria as tabelas
     Base.metadata.create_all(bind=engine)
+    # Cada teste começa sem histórico de rate limit
+    rate_limiter.reset()
     
     with TestClient(app) as c:
         yield c
@@ -48,7 +55,7 @@ def test_user():
     return {
         "username": "testuser",
         "email": "test@example.com",
-        "password": "testpass123",
+        "password": "Testpass123",
         "user_type": "user"
     }
 
@@ -58,7 +65,7 @@ def test_admin():
     return {
         "username": "testadmin",
         "email": "admin@example.com",
-        "password": "adminpass123",
+        "password": "Adminpass123",
         "user_type": "admin"
     }
 
@@ -220,6 +227,16 @@ class TestDataEndpoints:
         assert data["title"] == "Updated Title"
         assert data["content"] == "Original Content"  # Não foi alterado
     
+    def test_update_data_item_rejects_null_fields(self, client, auth_headers):
+        """Testa que null em título ou conteúdo é 422 e não altera o item"""
+        item_id = client.post("/data", json={"title": "Título", "content": "Conteúdo"}, headers=auth_headers).json()["id"]
+        
+        for field in ("title", "content"):
+            response = client.put(f"/data/{item_id}", json={field: None}, headers=auth_headers)
+            assert response.status_code == 422
+        data = client.get(f"/data/{item_id}", headers=auth_headers).json()
+        assert (data["title"], data["content"], data["version"]) == ("Título", "Conteúdo", 1)
+    
     def test_delete_data_item(self, client, auth_headers):
         """Testa exclusão de item"""
         # Cria um item
@@ -261,6 +278,1483 @@ class TestAdminEndpoints:
         response = client.get("/users", headers=admin_headers)
         assert response.status_code == 200
 
+class TestCursorPagination:
+    """Testes da paginação por cursor"""
+    
+    def test_cursor_walks_all_items_once(self, client, auth_headers):
+        """Testa que as páginas cobrem todos os itens, sem repetição, mesmo com created_at empatado"""
+        for i in range(7):
+            client.post("/data", json={"title": f"Item {i}", "content": "c"}, headers=auth_headers)
+        
+        seen = []
+        cursor = ""
+        while True:
+            response = client.get("/data", params={"cursor": cursor, "limit": 3}, headers=auth_headers)
+            assert response.status_code == 200
+            page = response.json()
+            assert page["total"] == 7
+            seen.extend(item["id"] for item in page["items"])
+            if not page["has_next"]:
+                break
+            cursor = page["next_cursor"]
+        
+        assert len(seen) == 7
+        assert seen == sorted(seen, reverse=True)
+    
+    def test_page_size_is_capped(self, client, auth_headers, monkeypatch):
+        """Testa que limit acima do máximo é reduzido"""
+        from config import settings
+        
+        monkeypatch.setattr(settings, "MAX_PAGE_SIZE", 2)
+        for i in range(3):
+            client.post("/data", json={"title": f"Item {i}", "content": "c"}, headers=auth_headers)
+        
+        assert len(client.get("/data?limit=1000", headers=auth_headers).json()) == 2
+        page = client.get("/data?cursor=&limit=1000", headers=auth_headers).json()
+        assert page["limit"] == 2
+        assert page["has_next"]
+    
+    def test_invalid_cursor(self, client, auth_headers):
+        """Testa cursor malformado"""
+        response = client.get("/data?cursor=nao-e-um-cursor", headers=auth_headers)
+        assert response.status_code == 400
+    
+    def test_users_cursor(self, client, admin_headers, test_user):
+        """Testa paginação por cursor em /users"""
+        client.post("/register", json=test_user)
+        page = client.get("/users?cursor=&limit=1", headers=admin_headers).json()
+        assert len(page["items"]) == 1
+        next_page = client.get(f"/users?cursor={page['next_cursor']}&limit=1", headers=admin_headers).json()
+        assert next_page["items"][0]["id"] != page["items"][0]["id"]
+
+class TestBatchCreate:
+    """Testes da criação de itens em lote"""
+    
+    def test_valid_items_created_and_errors_reported(self, client, auth_headers):
+        """Testa que itens inválidos não impedem a criação dos válidos"""
+        items = [
+            {"title": "Item 0", "content": "c"},
+            {"title": "   ", "content": "c"},
+            {"title": "Item 2", "content": "c"},
+            {"content": "sem título"},
+        ]
+        response = client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert [created["index"] for created in data["created"]] == [0, 2]
+        assert [error["index"] for error in data["errors"]] == [1, 3]
+        
+        item_id = data["created"][1]["id"]
+        assert client.get(f"/data/{item_id}", headers=auth_headers).json()["title"] == "Item 2"
+    
+    def test_atomic_batch_rejects_everything(self, client, auth_headers):
+        """Testa que atomic=true não cria nada se algum item for inválido"""
+        items = [{"title": "Ok", "content": "c"}, {"title": "", "content": "c"}]
+        response = client.post("/data/batch?atomic=true", json={"items": items}, headers=auth_headers)
+        assert response.status_code == 422
+        assert response.json()["detail"]["errors"][0]["index"] == 1
+        assert client.get("/data", headers=auth_headers).json() == []
+    
+    def test_batch_size_limit(self, client, auth_headers, monkeypatch):
+        """Testa o limite de itens por lote"""
+        from config import settings
+        
+        monkeypatch.setattr(settings, "MAX_BATCH_SIZE", 2)
+        items = [{"title": f"Item {i}", "content": "c"} for i in range(3)]
+        response = client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        assert response.status_code == 413
+    
+    def test_mixed_expiry_is_one_insert(self, client, auth_headers):
+        """Testa que itens com e sem expires_at entram no mesmo INSERT de várias linhas"""
+        from sqlalchemy import event
+        
+        items = [
+            {"title": f"Item {i}", "content": "c", **({"expires_at": "2999-01-01T00:00:00Z"} if i % 2 else {})}
+            for i in range(4)
+        ]
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            if statement.startswith("INSERT INTO data_items "):
+                statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert len(response.json()["created"]) == 4
+        assert len(statements) == 1
+        expiry = [item["expires_at"] for item in client.get("/data", headers=auth_headers).json()]
+        assert [value is not None for value in expiry] == [False, True, False, True]
+    
+    def test_past_expiry_is_rejected(self, client, auth_headers):
+        """Testa que um item já vencido não é criado nem contado"""
+        body = {"title": "Velho", "content": "c", "expires_at": "2000-01-01T00:00:00Z"}
+        assert client.post("/data", json=body, headers=auth_headers).status_code == 422
+        
+        response = client.post("/data/batch", json={"items": [body]}, headers=auth_headers)
+        assert response.json()["errors"][0]["index"] == 0
+        assert client.get("/me/stats", headers=auth_headers).json()["total_items"] == 0
+
+class TestSparseFields:
+    """Testes de fields= e excerpt nas listagens"""
+    
+    def test_fields_select_only_requested_columns(self, client, auth_headers):
+        """Testa que só os campos pedidos são lidos e retornados"""
+        from sqlalchemy import event
+        
+        client.post("/data", json={"title": "Nota", "content": "x" * 500}, headers=auth_headers)
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            if statement.startswith("SELECT") and "FROM data_items" in statement:
+                statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.get("/data?fields=title", headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert response.status_code == 200
+        assert list(response.json()[0]) == ["title", "id"]
+        assert "content" not in statements[0]
+    
+    def test_excerpt_and_cursor(self, client, auth_headers):
+        """Testa o corte de content no banco e a paginação com campos"""
+        for i in range(3):
+            client.post("/data", json={"title": f"Nota {i}", "content": "abcdefghij"}, headers=auth_headers)
+        
+        page = client.get("/data?cursor=&limit=2&excerpt=4", headers=auth_headers).json()
+        assert [item["content"] for item in page["items"]] == ["abcd", "abcd"]
+        assert set(page["items"][0]) == {
+            "id", "title", "content", "expires_at", "user_id", "version", "created_at", "updated_at"
+        }
+        
+        next_page = client.get(
+            f"/data?cursor={page['next_cursor']}&limit=2&fields=title,content&excerpt=2", headers=auth_headers
+        ).json()
+        assert next_page["items"] == [{"id": next_page["items"][0]["id"], "title": "Nota 0", "content": "ab"}]
+        assert next_page["total"] == 3
+    
+    def test_unknown_field(self, client, auth_headers):
+        """Testa campo inexistente"""
+        assert client.get("/data?fields=hashed_password", headers=auth_headers).status_code == 400
+
+class TestExport:
+    """Testes de GET /data/export"""
+    
+    def test_ndjson_export(self, client, auth_headers):
+        """Testa a exportação em NDJSON, com filtro e campos"""
+        import json
+        
+        for i in range(5):
+            client.post("/data", json={"title": f"Nota {i}", "content": "texto"}, headers=auth_headers)
+        
+        response = client.get("/data/export?fields=title&title_prefix=Nota", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["title"] for line in lines] == [f"Nota {i}" for i in range(5)]
+        assert set(lines[0]) == {"id", "title"}
+    
+    def test_csv_export_with_gzip(self, client, auth_headers):
+        """Testa CSV com gzip (o cliente descomprime pelo Content-Encoding)"""
+        import csv
+        
+        client.post("/data", json={"title": "Nota, com vírgula", "content": "a\nb"}, headers=auth_headers)
+        
+        response = client.get("/data/export?format=csv&compress=true", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        rows = list(csv.reader(response.text.splitlines(keepends=True)))
+        assert rows[0] == ["title", "content", "expires_at", "id", "user_id", "version", "created_at", "updated_at"]
+        assert rows[1][:2] == ["Nota, com vírgula", "a\nb"]
+    
+    def test_empty_csv_has_header(self, client, auth_headers):
+        """Testa que a exportação vazia ainda traz o cabeçalho"""
+        response = client.get("/data/export?format=csv&fields=title", headers=auth_headers)
+        assert response.text.splitlines() == ["title,id"]
+    
+    def test_invalid_format(self, client, auth_headers):
+        """Testa formato não suportado"""
+        assert client.get("/data/export?format=xml", headers=auth_headers).status_code == 422
+
+class TestImport:
+    """Testes de POST /data/import"""
+    
+    def test_import_commits_in_chunks(self, client, auth_headers, monkeypatch):
+        """Testa a importação em blocos com linhas inválidas numeradas"""
+        import json
+        from config import settings
+        from crud import DATA_ITEMS_COUNTER, get_counter
+        
+        monkeypatch.setattr(settings, "IMPORT_CHUNK_SIZE", 2)
+        lines = [json.dumps({"title": f"Nota {i}", "content": "texto"}) for i in range(5)]
+        lines.insert(2, "{quebrado")
+        lines.insert(4, "")
+        lines.append(json.dumps({"title": "Sem conteúdo"}))
+        body = ("\n".join(lines) + "\n").encode()
+        
+        def chunks():
+            # Partes de 7 bytes cortam as linhas no meio
+            for start in range(0, len(body), 7):
+                yield body[start:start + 7]
+        
+        response = client.post("/data/import", content=chunks(), headers=auth_headers)
+        assert response.status_code == 200
+        result = response.json()
+        assert result["created"] == 5
+        assert result["rejected"] == 2
+        assert [error["line"] for error in result["errors"]] == [3, 8]
+        assert result["errors"][0]["errors"][0]["type"] == "json_invalid"
+        
+        titles = [item["title"] for item in client.get("/data", headers=auth_headers).json()]
+        assert titles == [f"Nota {i}" for i in range(5)]
+        db = TestingSessionLocal()
+        try:
+            assert get_counter(db, DATA_ITEMS_COUNTER) == 5
+        finally:
+            db.close()
+    
+    def test_oversized_line_is_rejected(self, client, auth_headers, monkeypatch):
+        """Testa que uma linha grande demais é descartada sem parar a importação"""
+        from config import settings
+        
+        monkeypatch.setattr(settings, "IMPORT_MAX_LINE_BYTES", 64)
+        body = '{"title": "a", "content": "%s"}\n{"title": "b", "content": "ok"}' % ("x" * 100)
+        
+        result = client.post("/data/import", content=body, headers=auth_headers).json()
+        assert result["created"] == 1
+        assert result["errors"][0]["line"] == 1
+        assert result["errors"][0]["errors"][0]["type"] == "too_long"
+
+class TestUserDeletion:
+    """Testes da remoção de usuários (cascade e purga em segundo plano)"""
+    
+    @pytest.fixture(autouse=True)
+    def isolated_auth_versions(self, monkeypatch):
+        # A remoção revoga tokens no mapa global; ids se repetem entre testes
+        import auth
+        monkeypatch.setattr(auth, "_auth_versions", {})
+        monkeypatch.setattr(auth, "_auth_misses", {})
+    
+    def user_with_items(self, client, auth_headers, count):
+        for i in range(count):
+            client.post("/data", json={"title": f"Nota {i}", "content": "texto"}, headers=auth_headers)
+        return client.get("/me", headers=auth_headers).json()["id"]
+    
+    def test_delete_cascades_in_database(self, client, auth_headers, admin_headers):
+        """Testa que os itens do usuário saem junto com ele"""
+        from crud import DATA_ITEMS_COUNTER, USERS_COUNTER, get_counter
+        
+        user_id = self.user_with_items(client, auth_headers, 3)
+        
+        response = client.delete(f"/users/{user_id}", headers=admin_headers)
+        assert response.status_code == 200
+        db = TestingSessionLocal()
+        try:
+            assert db.query(DataItem).count() == 0
+            assert get_counter(db, DATA_ITEMS_COUNTER) == 0
+            assert get_counter(db, USERS_COUNTER) == 1
+        finally:
+            db.close()
+        assert client.delete(f"/users/{user_id}", headers=admin_headers).status_code == 404
+    
+    def test_large_user_is_purged_in_batches(self, client, auth_headers, admin_headers, monkeypatch):
+        """Testa a exclusão lógica seguida da purga em lotes"""
+        from config import settings
+        from crud import DATA_ITEMS_COUNTER, USERS_COUNTER, get_counter, purge_deleted_users
+        
+        monkeypatch.setattr(settings, "USER_PURGE_THRESHOLD", 2)
+        user_id = self.user_with_items(client, auth_headers, 5)
+        
+        response = client.delete(f"/users/{user_id}", headers=admin_headers)
+        assert response.status_code == 202
+        assert client.get("/me", headers=auth_headers).status_code in (400, 401)
+        
+        db = TestingSessionLocal()
+        try:
+            assert db.query(DataItem).count() == 5
+            assert purge_deleted_users(db, batch_size=2) == 1
+            assert db.query(DataItem).count() == 0
+            assert db.get(User, user_id) is None
+            assert get_counter(db, DATA_ITEMS_COUNTER) == 0
+            assert get_counter(db, USERS_COUNTER) == 1
+        finally:
+            db.close()
+
+    def test_delete_without_cascade_constraint(self, monkeypatch):
+        """Testa a remoção num banco criado antes do ON DELETE CASCADE"""
+        from crud import create_data_item, create_user, delete_user, purge_deleted_users, soft_delete_user
+        from models import DataItemCreate, UserCreate
+        
+        legacy_engine = create_engine(
+            "sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        event.listen(legacy_engine, "connect", enable_foreign_keys)
+        constraint = next(iter(DataItem.__table__.c.user_id.foreign_keys)).constraint
+        with monkeypatch.context() as patch:
+            patch.setattr(constraint, "ondelete", None)
+            Base.metadata.create_all(bind=legacy_engine)
+        
+        db = sessionmaker(bind=legacy_engine)()
+        try:
+            ddl = db.execute(text("SELECT sql FROM sqlite_master WHERE name = 'data_items'")).scalar_one()
+            assert "CASCADE" not in ddl
+            
+            user_ids = []
+            for name in ("antigo", "purgado"):
+                user = create_user(
+                    db, UserCreate(username=name, email=f"{name}@example.com", password="Testpass123")
+                )
+                for i in range(3):
+                    create_data_item(db, DataItemCreate(title=f"Nota {i}", content="texto"), user.id)
+                user_ids.append(user.id)
+            
+            assert delete_user(db, user_ids[0])
+            assert soft_delete_user(db, user_ids[1])
+            assert purge_deleted_users(db, batch_size=2) == 1
+            assert db.query(DataItem).count() == 0
+            assert db.query(User).count() == 0
+        finally:
+            db.close()
+            legacy_engine.dispose()
+
+class TestOptimisticConcurrency:
+    """Testes de ETag e If-Match nos itens"""
+    
+    def test_etag_and_conditional_put(self, client, auth_headers):
+        """Testa que um If-Match desatualizado retorna 412 sem alterar o item"""
+        item_id = client.post("/data", json={"title": "Nota", "content": "v1"}, headers=auth_headers).json()["id"]
+        
+        response = client.get(f"/data/{item_id}", headers=auth_headers)
+        etag = response.headers["etag"]
+        assert etag == '"1"'
+        
+        updated = client.put(
+            f"/data/{item_id}", json={"content": "v2"}, headers={**auth_headers, "If-Match": etag}
+        )
+        assert updated.status_code == 200
+        assert updated.headers["etag"] == '"2"'
+        assert updated.json()["version"] == 2
+        
+        stale = client.put(
+            f"/data/{item_id}", json={"content": "v3"}, headers={**auth_headers, "If-Match": etag}
+        )
+        assert stale.status_code == 412
+        assert client.get(f"/data/{item_id}", headers=auth_headers).json()["content"] == "v2"
+        
+        # Sem If-Match a escrita continua incondicional
+        assert client.put(f"/data/{item_id}", json={"content": "v3"}, headers=auth_headers).status_code == 200
+    
+    def test_conditional_delete(self, client, auth_headers):
+        """Testa DELETE com If-Match e a diferença entre 412 e 404"""
+        item_id = client.post("/data", json={"title": "Nota", "content": "v1"}, headers=auth_headers).json()["id"]
+        
+        assert client.delete(f"/data/{item_id}", headers={**auth_headers, "If-Match": '"7"'}).status_code == 412
+        assert client.delete(f"/data/{item_id}", headers={**auth_headers, "If-Match": "abc"}).status_code == 412
+        # Comparação forte: ETag fraco nunca confere
+        assert client.delete(f"/data/{item_id}", headers={**auth_headers, "If-Match": 'W/"1"'}).status_code == 412
+        assert client.delete(f"/data/{item_id}", headers={**auth_headers, "If-Match": '"1"'}).status_code == 200
+        assert client.delete(f"/data/{item_id}", headers={**auth_headers, "If-Match": '"1"'}).status_code == 404
+    
+    def test_if_match_list(self, client, auth_headers):
+        """Testa If-Match com vários ETags: basta um forte conferir"""
+        from fastapi import HTTPException
+        from main import if_match_versions
+        
+        item_id = client.post("/data", json={"title": "Nota", "content": "v1"}, headers=auth_headers).json()["id"]
+        
+        response = client.put(
+            f"/data/{item_id}", json={"content": "v2"}, headers={**auth_headers, "If-Match": '"1", "2"'}
+        )
+        assert response.status_code == 200
+        response = client.put(
+            f"/data/{item_id}", json={"content": "v3"}, headers={**auth_headers, "If-Match": 'W/"2", "1"'}
+        )
+        assert response.status_code == 412
+        
+        assert if_match_versions('"3",W/"4" , "x", "5"') == [3, 5]
+        for header in ('W/"1", W/"2"', '"1" "2"', '"1", abc'):
+            with pytest.raises(HTTPException) as error:
+                if_match_versions(header)
+            assert error.value.status_code == 412
+    
+    def test_conditional_write_is_single_statement(self, client, auth_headers):
+        """Testa que a checagem de versão não faz leitura extra"""
+        from sqlalchemy import event
+        
+        item_id = client.post("/data", json={"title": "Nota", "content": "v1"}, headers=auth_headers).json()["id"]
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            if "data_items" in statement:
+                statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.put(
+                f"/data/{item_id}", json={"title": "Nova"}, headers={**auth_headers, "If-Match": '"1"'}
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert response.status_code == 200
+        assert len(statements) == 1
+        assert statements[0].startswith("UPDATE") and "version IN (?)" in statements[0]
+
+class TestIdempotency:
+    """Testes de Idempotency-Key em POST /data"""
+    
+    def item_count(self):
+        db = TestingSessionLocal()
+        try:
+            return db.query(DataItem).count()
+        finally:
+            db.close()
+    
+    def test_retry_returns_stored_response(self, client, auth_headers):
+        """Testa que a retentativa devolve a resposta original sem criar outro item"""
+        headers = {**auth_headers, "Idempotency-Key": "abc-123"}
+        item = {"title": "Nota", "content": "texto"}
+        
+        first = client.post("/data", json=item, headers=headers)
+        retry = client.post("/data", json=item, headers=headers)
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json()
+        assert "idempotent-replayed" not in first.headers
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert self.item_count() == 1
+        
+        # Outra chave cria outro item; a mesma chave com outro corpo é rejeitada
+        assert client.post("/data", json=item, headers={**auth_headers, "Idempotency-Key": "outra"}).json()["id"] != first.json()["id"]
+        assert client.post("/data", json={"title": "Outra", "content": "x"}, headers=headers).status_code == 422
+    
+    def test_concurrent_duplicates_insert_once(self, client, auth_headers):
+        """Testa que requisições simultâneas com a mesma chave criam um só item"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        headers = {**auth_headers, "Idempotency-Key": "simultanea"}
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            responses = list(pool.map(
+                lambda _: client.post("/data", json={"title": "Nota", "content": "texto"}, headers=headers),
+                range(5)
+            ))
+        
+        assert {response.status_code for response in responses} == {200}
+        assert len({response.json()["id"] for response in responses}) == 1
+        assert self.item_count() == 1
+    
+    def test_expired_keys(self, client, auth_headers, monkeypatch):
+        """Testa que chaves expiradas não são reaproveitadas e são limpas"""
+        from config import settings
+        from crud import purge_idempotency_keys
+        from models import IdempotencyKey
+        
+        monkeypatch.setattr(settings, "IDEMPOTENCY_TTL", 0)
+        headers = {**auth_headers, "Idempotency-Key": "curta"}
+        first = client.post("/data", json={"title": "Nota", "content": "texto"}, headers=headers)
+        second = client.post("/data", json={"title": "Nota", "content": "texto"}, headers=headers)
+        assert first.json()["id"] != second.json()["id"]
+        
+        db = TestingSessionLocal()
+        try:
+            assert purge_idempotency_keys(db) == 1
+            assert db.query(IdempotencyKey).count() == 0
+        finally:
+            db.close()
+
+class TestItemExpiry:
+    """Testes de expires_at e do sweeper de itens vencidos"""
+    
+    def expire(self, item_id):
+        # Vence o item no banco, sem esperar o relógio
+        from datetime import datetime, timedelta
+        
+        db = TestingSessionLocal()
+        try:
+            db.query(DataItem).filter(DataItem.id == item_id).update(
+                {"expires_at": datetime.utcnow().replace(microsecond=0) - timedelta(minutes=1)}
+            )
+            db.commit()
+        finally:
+            db.close()
+    
+    def test_expired_items_are_hidden(self, client, auth_headers):
+        """Testa que itens vencidos somem de todas as leituras antes da remoção"""
+        kept = client.post(
+            "/data", json={"title": "Fica", "content": "nota fixa", "expires_at": "2999-01-01T00:00:00Z"},
+            headers=auth_headers
+        ).json()
+        gone = client.post("/data", json={"title": "Some", "content": "nota temporária"}, headers=auth_headers).json()
+        assert kept["expires_at"].startswith("2999-01-01T00:00:00")
+        self.expire(gone["id"])
+        
+        assert [item["id"] for item in client.get("/data", headers=auth_headers).json()] == [kept["id"]]
+        assert [item["id"] for item in client.get("/data?cursor=", headers=auth_headers).json()["items"]] == [kept["id"]]
+        assert client.get(f"/data/{gone['id']}", headers=auth_headers).status_code == 404
+        assert client.put(f"/data/{gone['id']}", json={"title": "x"}, headers=auth_headers).status_code == 404
+        assert client.get("/data/search?q=nota", headers=auth_headers).json()["items"][0]["id"] == kept["id"]
+        assert len(client.get("/data/search?q=nota", headers=auth_headers).json()["items"]) == 1
+        assert len(client.get("/data/export", headers=auth_headers).text.splitlines()) == 1
+    
+    def test_sweeper_deletes_in_batches(self, client, auth_headers):
+        """Testa o sweeper em lotes pelo índice parcial, com os contadores"""
+        from crud import DATA_ITEMS_COUNTER, get_counter, sweep_expired_data_items
+        
+        ids = [
+            client.post("/data", json={"title": f"Nota {i}", "content": "texto"}, headers=auth_headers).json()["id"]
+            for i in range(5)
+        ]
+        for item_id in ids[:3]:
+            self.expire(item_id)
+        
+        db = TestingSessionLocal()
+        try:
+            assert sweep_expired_data_items(db, batch_size=2) == 3
+            assert db.query(DataItem).count() == 2
+            assert get_counter(db, DATA_ITEMS_COUNTER) == 2
+            plan = db.execute(text(
+                "EXPLAIN QUERY PLAN SELECT id FROM data_items WHERE expires_at <= '2030-01-01 00:00:00'"
+            )).fetchall()
+            assert "idx_data_expires_at" in plan[0][-1]
+        finally:
+            db.close()
+
+class TestCounters:
+    """Testes dos contadores de totais"""
+    
+    def counters(self):
+        from crud import DATA_ITEMS_COUNTER, USERS_COUNTER, get_counter
+        
+        db = TestingSessionLocal()
+        try:
+            return (
+                get_counter(db, USERS_COUNTER),
+                get_counter(db, DATA_ITEMS_COUNTER),
+                {user_id: get_counter(db, DATA_ITEMS_COUNTER, user_id) for user_id in (1, 2)},
+            )
+        finally:
+            db.close()
+    
+    def test_writes_maintain_counters(self, client, auth_headers, admin_headers):
+        """Testa que criação e exclusão atualizam os contadores"""
+        client.post("/data", json={"title": "a", "content": "c"}, headers=auth_headers)
+        items = [{"title": f"b{i}", "content": "c"} for i in range(3)]
+        ids = [created["id"] for created in client.post(
+            "/data/batch", json={"items": items}, headers=auth_headers
+        ).json()["created"]]
+        client.post("/data", json={"title": "admin", "content": "c"}, headers=admin_headers)
+        assert self.counters() == (2, 5, {1: 4, 2: 1})
+        
+        client.delete(f"/data/{ids[0]}", headers=auth_headers)
+        client.request("DELETE", "/data", json={"ids": ids[1:]}, headers=auth_headers)
+        assert self.counters() == (2, 2, {1: 1, 2: 1})
+        
+        page = client.get("/data?cursor=", headers=admin_headers).json()
+        assert page["total"] == 2
+        filtered = client.get("/data?cursor=&title_prefix=a", headers=admin_headers).json()
+        assert filtered["total"] is None
+        assert client.get("/users?cursor=", headers=admin_headers).json()["total"] == 2
+    
+    def test_reconcile_fixes_drift(self, client, auth_headers):
+        """Testa que a reconciliação corrige contadores divergentes"""
+        from crud import reconcile_counters
+        from models import Counter
+        
+        client.post("/data", json={"title": "a", "content": "c"}, headers=auth_headers)
+        db = TestingSessionLocal()
+        db.query(Counter).update({"value": 99})
+        db.add(Counter(name="data_items", user_id=2, value=5))
+        db.commit()
+        reconcile_counters(db)
+        db.close()
+        assert self.counters() == (1, 1, {1: 1, 2: 0})
+
+class TestStats:
+    """Testes das estatísticas por rollups"""
+    
+    def test_user_and_system_stats(self, client, auth_headers, admin_headers):
+        """Testa /me/stats e /stats"""
+        client.post("/data", json={"title": "a", "content": "c"}, headers=auth_headers)
+        items = [{"title": f"b{i}", "content": "c"} for i in range(2)]
+        client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        
+        stats = client.get("/me/stats", headers=auth_headers).json()
+        assert stats["total_items"] == 3
+        assert stats["items_this_month"] == 3
+        assert stats["last_activity"] is not None
+        
+        system = client.get("/stats", headers=admin_headers).json()
+        # Os dois usuários fizeram login hoje
+        assert system == {"total_users": 2, "total_items": 3, "active_users_today": 2, "items_created_today": 3}
+        assert client.get("/stats", headers=auth_headers).status_code == 403
+    
+    def test_backfill_matches_incremental_rollups(self, client, auth_headers):
+        """Testa que o backfill reconstrói os mesmos rollups de itens"""
+        from crud import backfill_rollups
+        from models import DailySystemStats, DailyUserActivity
+        
+        for i in range(3):
+            client.post("/data", json={"title": f"a{i}", "content": "c"}, headers=auth_headers)
+        before = client.get("/me/stats", headers=auth_headers).json()
+        
+        db = TestingSessionLocal()
+        db.query(DailyUserActivity).delete()
+        db.query(DailySystemStats).delete()
+        db.commit()
+        backfill_rollups(db)
+        db.close()
+        
+        after = client.get("/me/stats", headers=auth_headers).json()
+        assert after["items_this_month"] == before["items_this_month"] == 3
+
+class TestDataItemFilters:
+    """Testes dos filtros de GET /data"""
+    
+    def test_filters_applied_server_side(self, client, auth_headers, admin_headers):
+        """Testa os filtros por título e por usuário"""
+        for title in ("relatório mensal", "relatório anual", "notas"):
+            client.post("/data", json={"title": title, "content": "c"}, headers=auth_headers)
+        client.post("/data", json={"title": "relatório do admin", "content": "c"}, headers=admin_headers)
+        
+        titles = [item["title"] for item in client.get(
+            "/data", params={"title_prefix": "relatório"}, headers=auth_headers
+        ).json()]
+        assert titles == ["relatório mensal", "relatório anual"]
+        
+        page = client.get("/data", params={"cursor": "", "title_contains": "anual"}, headers=auth_headers).json()
+        assert [item["title"] for item in page["items"]] == ["relatório anual"]
+        
+        me = client.get("/me", headers=auth_headers).json()
+        items = client.get("/data", params={"user_id": me["id"]}, headers=admin_headers).json()
+        assert len(items) == 3
+        assert client.get("/data", params={"created_after": "2100-01-01T00:00:00Z"}, headers=auth_headers).json() == []
+    
+    def test_filter_combinations_search_an_index(self):
+        """
+        Testa via EXPLAIN QUERY PLAN que as combinações de filtros indexáveis
+        fazem SEARCH em um índice de data_items
+
+        Sem dono, sem cursor e sem filtro indexável (nenhum filtro ou só
+        title_contains, que é um LIKE '%...%') não há faixa para buscar: a
+        consulta percorre idx_data_created_id na ordem da listagem e para no
+        LIMIT. Essas combinações só precisam usar o índice, sem ordenar a
+        tabela inteira.
+        """
+        import itertools
+        from datetime import datetime
+        from sqlalchemy import event
+        from crud import get_data_item_rows, get_data_item_rows_page, data_item_columns
+        from models import DataItemFilters, DATA_ITEM_FIELDS
+        
+        values = {
+            "title_prefix": "rel",
+            "title_contains": "anual",
+            "user_id": 1,
+            "created_after": datetime(2024, 1, 1),
+            "created_before": datetime(2030, 1, 1),
+        }
+        cursor = "WyIyMDI1LTAxLTAxVDAwOjAwOjAwIiwxMF0"
+        columns = data_item_columns(DATA_ITEM_FIELDS, None)
+        statements = []
+        
+        def record(conn, db_cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT") and "data_items" in statement:
+                statements.append((statement, parameters))
+        
+        Base.metadata.create_all(bind=engine)
+        event.listen(engine, "before_cursor_execute", record)
+        cases = []
+        try:
+            db = TestingSessionLocal()
+            for size in range(len(values) + 1):
+                for names in itertools.combinations(values, size):
+                    filters = DataItemFilters(**{name: values[name] for name in names})
+                    for owner_id in (None, 1):
+                        indexable = owner_id is not None or bool(set(names) - {"title_contains"})
+                        calls = [
+                            (indexable, lambda: get_data_item_rows(db, columns, filters=filters, owner_id=owner_id)),
+                            (indexable, lambda: get_data_item_rows_page(db, columns, filters=filters, owner_id=owner_id)),
+                            (True, lambda: get_data_item_rows_page(
+                                db, columns, filters=filters, owner_id=owner_id, cursor=cursor
+                            )),
+                        ]
+                        for expect_search, call in calls:
+                            call()
+                            cases.append((statements[-1], expect_search))
+            db.close()
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        with engine.connect() as conn:
+            for (statement, parameters), expect_search in cases:
+                plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+                details = [row[-1] for row in plan]
+                access = [detail for detail in details if "data_items" in detail]
+                if expect_search:
+                    assert access[0].startswith("SEARCH data_items USING"), (statement, details)
+                else:
+                    assert access[0].startswith("SCAN data_items USING INDEX"), (statement, details)
+                    assert not any("TEMP B-TREE" in detail for detail in details), (statement, details)
+        Base.metadata.drop_all(bind=engine)
+
+class TestFullTextSearch:
+    """Testes da busca textual (FTS5)"""
+    
+    def test_search_ranks_and_highlights(self, client, auth_headers):
+        """Testa ranking, destaque e sincronização por triggers"""
+        items = [
+            {"title": "Receita de bolo", "content": "Farinha, ovos e açúcar para o bolo"},
+            {"title": "Lista de compras", "content": "Comprar farinha, café e fermento para bolo"},
+            {"title": "Reunião", "content": "Pauta da reunião de segunda"},
+        ]
+        client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        
+        page = client.get("/data/search", params={"q": "bolo"}, headers=auth_headers).json()
+        # O termo no título e no conteúdo pesa mais que só no conteúdo
+        assert [hit["title"] for hit in page["items"]] == ["Receita de bolo", "Lista de compras"]
+        assert page["items"][0]["title_highlight"] == "Receita de <mark>bolo</mark>"
+        assert "<mark>bolo</mark>" in page["items"][1]["snippet"]
+        
+        page = client.get("/data/search", params={"q": "FARINHA acucar"}, headers=auth_headers).json()
+        assert [hit["title"] for hit in page["items"]] == ["Receita de bolo"]
+        
+        # Atualizações e exclusões refletem no índice
+        item_id = page["items"][0]["id"]
+        client.put(f"/data/{item_id}", json={"title": "Receita de pão"}, headers=auth_headers)
+        assert client.get("/data/search", params={"q": "pão"}, headers=auth_headers).json()["items"][0]["id"] == item_id
+        client.delete(f"/data/{item_id}", headers=auth_headers)
+        assert client.get("/data/search", params={"q": "pão"}, headers=auth_headers).json()["items"] == []
+    
+    def test_search_is_owner_scoped_and_paginated(self, client, auth_headers, admin_headers):
+        """Testa escopo do dono e paginação por cursor"""
+        items = [{"title": f"Nota {i}", "content": "projeto alfa"} for i in range(5)]
+        client.post("/data/batch", json={"items": items}, headers=auth_headers)
+        client.post("/data", json={"title": "Do admin", "content": "projeto alfa"}, headers=admin_headers)
+        
+        seen, cursor = [], None
+        while True:
+            params = {"q": "projeto", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            page = client.get("/data/search", params=params, headers=auth_headers).json()
+            seen.extend(hit["id"] for hit in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert len(seen) == len(set(seen)) == 5
+        
+        admin_page = client.get("/data/search", params={"q": "alfa", "limit": 50}, headers=admin_headers).json()
+        assert len(admin_page["items"]) == 6
+    
+    def test_page_is_cut_before_highlighting(self, client, auth_headers):
+        """Testa que dono e LIMIT entram na consulta do MATCH, antes de highlight/snippet"""
+        from sqlalchemy import event
+        
+        client.post("/data", json={"title": "Nota", "content": "projeto alfa"}, headers=auth_headers)
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            if "data_items_fts MATCH" in statement:
+                statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.get("/data/search", params={"q": "projeto"}, headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert len(response.json()["items"]) == 1
+        statement = statements[0]
+        assert statement.index("MATCH") < statement.index("d.user_id = ?") < statement.index("LIMIT")
+        assert statement.index("LIMIT") < statement.index("highlight(")
+        assert statement.index("LIMIT") < statement.index("snippet(")
+    
+    def test_query_syntax_is_not_interpreted(self, client, auth_headers):
+        """Testa que operadores do FTS5 na consulta não geram erro"""
+        response = client.get("/data/search", params={"q": 'NEAR("x" AND *'}, headers=auth_headers)
+        assert response.status_code == 200
+
+class TestBulkOperations:
+    """Testes de atualização e exclusão em massa"""
+    
+    def create_items(self, client, headers, titles):
+        items = [{"title": title, "content": "c"} for title in titles]
+        response = client.post("/data/batch", json={"items": items}, headers=headers)
+        return [created["id"] for created in response.json()["created"]]
+    
+    def test_bulk_update_by_filter(self, client, auth_headers):
+        """Testa atualização por filtro"""
+        self.create_items(client, auth_headers, ["rascunho 1", "rascunho 2", "final"])
+        body = {"filters": {"title_contains": "rascunho"}, "changes": {"content": "revisado"}}
+        
+        response = client.patch("/data", json=body, headers=auth_headers)
+        assert response.json() == {"affected": 2, "dry_run": False}
+        contents = {item["title"]: item["content"] for item in client.get("/data", headers=auth_headers).json()}
+        assert contents == {"rascunho 1": "revisado", "rascunho 2": "revisado", "final": "c"}
+    
+    def test_bulk_delete_by_ids_with_dry_run(self, client, auth_headers):
+        """Testa dry_run e exclusão por ids"""
+        ids = self.create_items(client, auth_headers, ["a", "b", "c"])
+        body = {"ids": ids[:2], "dry_run": True}
+        
+        response = client.request("DELETE", "/data", json=body, headers=auth_headers)
+        assert response.json() == {"affected": 2, "dry_run": True}
+        assert len(client.get("/data", headers=auth_headers).json()) == 3
+        
+        body["dry_run"] = False
+        response = client.request("DELETE", "/data", json=body, headers=auth_headers)
+        assert response.json()["affected"] == 2
+        assert [item["id"] for item in client.get("/data", headers=auth_headers).json()] == ids[2:]
+    
+    def test_bulk_operations_are_owner_scoped(self, client, auth_headers, admin_headers):
+        """Testa que usuários comuns não afetam itens de outros"""
+        ids = self.create_items(client, admin_headers, ["do admin"])
+        response = client.request("DELETE", "/data", json={"ids": ids}, headers=auth_headers)
+        assert response.json()["affected"] == 0
+        assert client.get(f"/data/{ids[0]}", headers=admin_headers).status_code == 200
+    
+    def test_selection_required(self, client, auth_headers):
+        """Testa que a operação sem ids nem filtros é rejeitada"""
+        response = client.request("DELETE", "/data", json={"filters": {}}, headers=auth_headers)
+        assert response.status_code == 400
+    
+    def test_empty_string_filters_are_rejected(self, client, auth_headers, admin_headers):
+        """Testa que filtros vazios não viram uma operação sobre todos os itens"""
+        from fastapi import HTTPException
+        from main import bulk_conditions
+        from models import DataItemBulkSelection, DataItemFilters
+        
+        self.create_items(client, auth_headers, ["a", "b"])
+        for filters in ({"title_contains": ""}, {"title_prefix": ""}):
+            for dry_run in (True, False):
+                body = {"filters": filters, "dry_run": dry_run}
+                assert client.request("DELETE", "/data", json=body, headers=admin_headers).status_code == 422
+                body["changes"] = {"content": "x"}
+                assert client.patch("/data", json=body, headers=admin_headers).status_code == 422
+        assert {item["content"] for item in client.get("/data", headers=auth_headers).json()} == {"c"}
+        
+        # Mesmo que um filtro sem efeito passe pela validação, a guarda olha as condições montadas
+        selection = DataItemBulkSelection(filters=DataItemFilters.model_construct(title_contains=""))
+        admin = client.get("/me", headers=admin_headers).json()
+        with pytest.raises(HTTPException) as error:
+            bulk_conditions(selection, UserResponse(**admin))
+        assert error.value.status_code == 400
+    
+    def test_null_changes_are_rejected(self, client, auth_headers):
+        """Testa que null em campos obrigatórios é 422 e null em expires_at remove a validade"""
+        ids = self.create_items(client, auth_headers, ["a"])
+        for body in ({"ids": ids, "changes": {"title": None}}, {"changes": {"content": None}}):
+            assert client.patch("/data", json=body, headers=auth_headers).status_code == 422
+        
+        client.put(f"/data/{ids[0]}", json={"expires_at": "2999-01-01T00:00:00Z"}, headers=auth_headers)
+        body = {"ids": ids, "changes": {"expires_at": None}}
+        assert client.patch("/data", json=body, headers=auth_headers).json()["affected"] == 1
+        item = client.get(f"/data/{ids[0]}", headers=auth_headers).json()
+        assert (item["title"], item["content"], item["expires_at"]) == ("a", "c", None)
+
+class TestOwnerScopedItems:
+    """Testes das operações por item restritas ao dono"""
+    
+    @pytest.fixture
+    def other_headers(self, client):
+        """Headers de um segundo usuário comum"""
+        user = {"username": "otheruser", "email": "other@example.com", "password": "Otherpass123"}
+        client.post("/register", json=user)
+        token = client.post("/login", json={"username": user["username"], "password": user["password"]}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    def test_other_users_item_is_forbidden(self, client, auth_headers, other_headers):
+        """Testa 403 para item de outro usuário e 404 para item inexistente"""
+        item_id = client.post("/data", json={"title": "Mine", "content": "c"}, headers=auth_headers).json()["id"]
+        
+        assert client.get(f"/data/{item_id}", headers=other_headers).status_code == 403
+        assert client.put(f"/data/{item_id}", json={"title": "X"}, headers=other_headers).status_code == 403
+        assert client.delete(f"/data/{item_id}", headers=other_headers).status_code == 403
+        assert client.get(f"/data/{item_id}", headers=auth_headers).json()["title"] == "Mine"
+        
+        assert client.put("/data/999999", json={"title": "X"}, headers=auth_headers).status_code == 404
+        assert client.delete("/data/999999", headers=auth_headers).status_code == 404
+    
+    def test_admin_updates_any_item(self, client, auth_headers, admin_headers):
+        """Testa que admins alteram itens de outros usuários"""
+        item_id = client.post("/data", json={"title": "Mine", "content": "c"}, headers=auth_headers).json()["id"]
+        response = client.put(f"/data/{item_id}", json={"content": "novo"}, headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["content"] == "novo"
+        assert response.json()["title"] == "Mine"
+    
+    def test_single_statement_per_operation(self, client, auth_headers):
+        """Testa que GET/PUT/DELETE fazem um único comando no caminho feliz"""
+        from sqlalchemy import event
+        
+        item_id = client.post("/data", json={"title": "Mine", "content": "c"}, headers=auth_headers).json()["id"]
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            if "data_items" in statement:
+                statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            client.get(f"/data/{item_id}", headers=auth_headers)
+            client.put(f"/data/{item_id}", json={"title": "Novo"}, headers=auth_headers)
+            client.delete(f"/data/{item_id}", headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert len(statements) == 3
+        assert "RETURNING" in statements[1] and "RETURNING" in statements[2]
+
+class TestPasswordHashing:
+    """Testes do executor de hashing de senhas"""
+    
+    def test_hash_async_roundtrip(self):
+        """Testa hash e verificação pelo executor dedicado"""
+        import asyncio
+        from auth import get_password_hash_async, verify_password_async
+        
+        async def roundtrip():
+            hashed = await get_password_hash_async("Secret123")
+            return (
+                await verify_password_async("Secret123", hashed),
+                await verify_password_async("Wrong123", hashed)
+            )
+        
+        assert asyncio.run(roundtrip()) == (True, False)
+    
+    def test_login_returns_503_when_saturated(self, client, test_user, monkeypatch):
+        """Testa que o login retorna 503 quando a fila de hashing está cheia"""
+        import threading
+        import auth
+        
+        client.post("/register", json=test_user)
+        monkeypatch.setattr(auth, "_password_slots", threading.BoundedSemaphore(1))
+        auth._password_slots.acquire()
+        
+        login_data = {
+            "username": test_user["username"],
+            "password": test_user["password"]
+        }
+        response = client.post("/login", json=login_data)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+class TestAsyncDatabase:
+    """Testes da camada assíncrona de banco de dados"""
+    
+    def test_async_database_url(self):
+        """Testa conversão da URL para os drivers assíncronos"""
+        from database import get_async_database_url
+        
+        assert get_async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+        assert (
+            get_async_database_url("postgresql://u:p@localhost/db")
+            == "postgresql+asyncpg://u:p@localhost/db"
+        )
+    
+    def test_run_db_with_async_session(self):
+        """Testa funções de crud.py executadas em uma AsyncSession"""
+        import asyncio
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        from database import run_db
+        from models import UserCreate, DataItemCreate
+        from crud import create_user, create_data_item, data_item_columns, get_data_item_rows
+        
+        async def scenario():
+            async_engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+            async with async_engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            
+            async with async_sessionmaker(async_engine, expire_on_commit=False)() as db:
+                user = UserCreate(username="asyncuser", email="async@example.com", password="Async1234")
+                db_user = await run_db(db, create_user, user, hashed_password="hash")
+                await run_db(db, create_data_item, DataItemCreate(title="T", content="C"), db_user.id)
+                items = await run_db(db, get_data_item_rows, data_item_columns(["title"]), owner_id=db_user.id)
+            
+            await async_engine.dispose()
+            return [item.title for item in items]
+        
+        assert asyncio.run(scenario()) == ["T"]
+
+class TestClaimsOnlyAuth:
+    """Testes da autenticação apenas por claims do token"""
+    
+    @pytest.fixture(autouse=True)
+    def claims_only(self, monkeypatch):
+        # Tabela de versões isolada (ids se repetem entre testes) e sem a
+        # recarga periódica, que leria o banco da aplicação
+        import auth
+        from config import settings
+        
+        monkeypatch.setattr(settings, "AUTH_CLAIMS_ONLY", True)
+        monkeypatch.setattr(settings, "AUTH_VERSION_REFRESH_INTERVAL", 0)
+        monkeypatch.setattr(auth, "_auth_versions", {})
+        monkeypatch.setattr(auth, "_auth_misses", {})
+        monkeypatch.setattr(auth, "_auth_versions_synced_at", None)
+    
+    def test_protected_route_skips_user_query(self, client, auth_headers, monkeypatch):
+        """Testa que rotas protegidas não consultam o usuário no banco"""
+        import auth
+        
+        def fail(*args, **kwargs):
+            raise AssertionError("consulta de usuário não esperada")
+        
+        monkeypatch.setattr(auth, "_get_user_by_username", fail)
+        response = client.get("/data", headers=auth_headers)
+        assert response.status_code == 200
+    
+    def test_auth_version_bump_revokes_token(self, client, auth_headers, monkeypatch):
+        """Testa que update_user revoga tokens com versão antiga"""
+        from crud import update_user
+        from models import UserUpdate
+        
+        me = client.get("/me", headers=auth_headers).json()
+        
+        db = TestingSessionLocal()
+        try:
+            updated = update_user(db, me["id"], UserUpdate(user_type="moderator"))
+            assert updated.auth_version == 1
+        finally:
+            db.close()
+        
+        response = client.get("/data", headers=auth_headers)
+        assert response.status_code == 401
+    
+    def test_revocation_by_other_worker_is_loaded(self, client, auth_headers):
+        """Testa que a recarga lê só as mudanças novas e aplica a revogação de outro worker"""
+        from datetime import datetime, timedelta, timezone
+        from auth import refresh_auth_versions
+        from models import UserAuthChange
+        
+        user_id = client.get("/me", headers=auth_headers).json()["id"]
+        db = TestingSessionLocal()
+        try:
+            now = datetime.now(timezone.utc)
+            db.add(UserAuthChange(user_id=user_id, auth_version=9, changed_at=now - timedelta(hours=1)))
+            db.commit()
+            assert refresh_auth_versions(db) == 0
+            
+            # Outro worker revogou os tokens: só o banco sabe
+            db.query(User).update({User.auth_version: User.auth_version + 1})
+            db.add(UserAuthChange(user_id=user_id, auth_version=1, changed_at=now))
+            db.commit()
+            assert client.get("/data", headers=auth_headers).status_code == 200
+            assert refresh_auth_versions(db) == 1
+        finally:
+            db.close()
+        
+        assert client.get("/data", headers=auth_headers).status_code == 401
+    
+    def test_deleted_user_token_stays_rejected_after_restart(self, client, auth_headers, admin_headers, monkeypatch):
+        """Testa que o token de um usuário removido é recusado após um restart, consultando o banco uma vez"""
+        import auth
+        from config import settings
+        
+        user_id = client.get("/me", headers=auth_headers).json()["id"]
+        assert client.delete(f"/users/{user_id}", headers=admin_headers).status_code == 200
+        assert client.get("/data", headers=auth_headers).status_code == 401
+        
+        # Restart: tabela vazia; a consulta ao banco não acha o usuário
+        monkeypatch.setattr(settings, "AUTH_VERSION_REFRESH_INTERVAL", 60)
+        auth._auth_versions.clear()
+        auth._auth_misses.clear()
+        assert client.get("/data", headers=auth_headers).status_code == 401
+        
+        # O id ausente fica em cache até a próxima recarga
+        def fail(*args, **kwargs):
+            raise AssertionError("consulta de usuário não esperada")
+        
+        monkeypatch.setattr(auth, "_load_user_auth_version", fail)
+        assert client.post("/data", json={"title": "a", "content": "b"}, headers=auth_headers).status_code == 401
+    
+    def test_forgotten_user_is_not_added_back(self, client, auth_headers, monkeypatch):
+        """Testa que leituras feitas antes da remoção não recolocam o usuário na tabela"""
+        from datetime import datetime, timezone
+        import auth
+        from config import settings
+        from models import UserAuthChange
+        
+        monkeypatch.setattr(settings, "AUTH_VERSION_REFRESH_INTERVAL", 60)
+        user_id = client.get("/me", headers=auth_headers).json()["id"]
+        db = TestingSessionLocal()
+        try:
+            auth.refresh_auth_versions(db)
+            db.add(UserAuthChange(user_id=user_id, auth_version=0, changed_at=datetime.now(timezone.utc)))
+            db.commit()
+            
+            # A remoção acontece entre a leitura e a aplicação
+            auth.forget_auth_version(user_id)
+            auth.refresh_auth_versions(db)
+            auth._load_user_auth_version(db, user_id)
+        finally:
+            db.close()
+        assert user_id not in auth._auth_versions
+        assert client.get("/data", headers=auth_headers).status_code == 401
+
+class TestTokenCache:
+    """Testes do cache de tokens decodificados"""
+    
+    def test_repeated_token_hits_cache(self):
+        """Testa que o mesmo token só é decodificado uma vez"""
+        from datetime import timedelta
+        from auth import create_access_token, verify_token, get_token_cache_stats, clear_token_cache
+        
+        clear_token_cache()
+        token = create_access_token({"sub": "cached", "user_id": 1}, timedelta(minutes=5))
+        first = verify_token(token)
+        second = verify_token(token)
+        
+        assert first.username == second.username == "cached"
+        assert get_token_cache_stats() == {"hits": 1, "misses": 1, "size": 1}
+    
+    def test_expired_entry_is_evicted(self, monkeypatch):
+        """Testa que entradas são removidas ao atingir o exp"""
+        import auth
+        from datetime import timedelta
+        
+        auth.clear_token_cache()
+        token = auth.create_access_token({"sub": "expiring"}, timedelta(minutes=5))
+        assert auth.verify_token(token) is not None
+        
+        # Após o exp a entrada não é reaproveitada: o token volta a ser decodificado
+        future = auth.time.time() + 600
+        monkeypatch.setattr(auth.time, "time", lambda: future)
+        auth.verify_token(token)
+        assert auth.get_token_cache_stats()["hits"] == 0
+        assert auth.get_token_cache_stats()["misses"] == 2
+    
+    def test_invalid_token_not_cached(self):
+        """Testa que tokens inválidos não ocupam o cache"""
+        from auth import verify_token, get_token_cache_stats, clear_token_cache
+        
+        clear_token_cache()
+        assert verify_token("invalid_token") is None
+        assert get_token_cache_stats()["size"] == 0
+
+class TestRateLimiter:
+    """Testes do limitador GCRA"""
+    
+    def test_burst_then_retry_after(self):
+        """Testa que o burst é consumido e o Retry-After reflete o intervalo"""
+        from rate_limit import MemoryRateLimiter
+        
+        limiter = MemoryRateLimiter(requests_per_minute=60, burst=3)
+        results = [limiter.hit("1.2.3.4", now=100.0) for _ in range(4)]
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results[:3]] == [2, 1, 0]
+        assert results[3].retry_after == pytest.approx(1.0)
+        
+        # Um intervalo depois, uma nova requisição é aceita
+        assert limiter.hit("1.2.3.4", now=101.0).allowed
+    
+    def test_idle_keys_are_evicted(self):
+        """Testa que o número de chaves é limitado por LRU"""
+        from rate_limit import MemoryRateLimiter
+        
+        limiter = MemoryRateLimiter(requests_per_minute=60, max_keys=100)
+        for i in range(1000):
+            limiter.hit(f"10.0.{i // 256}.{i % 256}", now=float(i))
+        assert len(limiter) == 100
+
+def _shared_limiter_worker(path, barrier, hits, results):
+    """Processo que dispara requisições contra o limitador compartilhado"""
+    from rate_limit import SharedMemoryRateLimiter
+    
+    limiter = SharedMemoryRateLimiter(path, requests_per_minute=1, burst=25)
+    barrier.wait()
+    results.put(sum(limiter.hit("203.0.113.7").allowed for _ in range(hits)))
+
+class TestSharedMemoryRateLimiter:
+    """Testes do limitador compartilhado entre processos"""
+    
+    def test_global_limit_holds_across_processes(self, tmp_path):
+        """Testa que vários processos juntos não passam do burst global"""
+        import multiprocessing
+        from rate_limit import SharedMemoryRateLimiter
+        
+        path = str(tmp_path / "ratelimit")
+        SharedMemoryRateLimiter(path, requests_per_minute=1, burst=25).close()
+        
+        ctx = multiprocessing.get_context("fork")
+        barrier = ctx.Barrier(4)
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=_shared_limiter_worker, args=(path, barrier, 50, results))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        allowed = sum(results.get(timeout=30) for _ in processes)
+        for process in processes:
+            process.join()
+        
+        assert allowed == 25
+    
+    def test_state_is_shared_between_instances(self, tmp_path):
+        """Testa que duas instâncias sobre o mesmo arquivo veem o mesmo estado"""
+        from rate_limit import SharedMemoryRateLimiter
+        
+        path = str(tmp_path / "ratelimit")
+        first = SharedMemoryRateLimiter(path, requests_per_minute=60, burst=2)
+        second = SharedMemoryRateLimiter(path, requests_per_minute=60, burst=2)
+        
+        assert first.hit("1.2.3.4", now=100.0).allowed
+        assert second.hit("1.2.3.4", now=100.0).allowed
+        result = first.hit("1.2.3.4", now=100.0)
+        assert not result.allowed
+        assert result.retry_after == pytest.approx(1.0)
+        
+        second.reset()
+        assert first.hit("1.2.3.4", now=100.0).remaining == 1
+
+class FakeRedisServer:
+    """
+    Servidor RESP mínimo para testes do limitador distribuído
+    Emula em Python o script GCRA de RedisRateLimiter
+    """
+    
+    def __init__(self, delay: float = 0.0):
+        import threading
+        
+        self.delay = delay
+        self.values = {}
+        self.scripts = set()
+        self.script_calls = 0
+        self._handlers = set()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+    
+    def __exit__(self, *exc):
+        import asyncio
+        
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+    
+    async def _shutdown(self):
+        import asyncio
+        
+        # Fecha o servidor e encerra as conexões ainda abertas antes de parar o loop
+        self._server.close()
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+    
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+    
+    def _run(self):
+        import asyncio
+        
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+    
+    def _gcra(self, key, interval, tolerance, wanted):
+        import math
+        import time
+        
+        now = time.time()
+        tat = max(self.values.get(key, now), now)
+        granted = min(math.floor((now + tolerance - tat) / interval + 1e-9), wanted)
+        if granted <= 0:
+            return [0, str(tat + interval - tolerance - now)]
+        new_tat = tat + granted * interval
+        self.values[key] = new_tat
+        return [granted, str(math.floor((now + tolerance - new_tat) / interval + 1e-9))]
+    
+    def _command(self, args):
+        import hashlib
+        
+        name = args[0].upper()
+        if name in (b"PING", b"AUTH", b"SELECT"):
+            return "+OK"
+        if name in (b"EVAL", b"EVALSHA"):
+            sha = hashlib.sha1(args[1]).hexdigest().encode() if name == b"EVAL" else args[1]
+            if name == b"EVAL":
+                self.scripts.add(sha)
+            elif sha not in self.scripts:
+                return "-NOSCRIPT No matching script"
+            self.script_calls += 1
+            return self._gcra(args[3], float(args[4]), float(args[5]), int(args[6]))
+        return "-ERR unknown command"
+    
+    @staticmethod
+    def _encode(reply) -> bytes:
+        if isinstance(reply, str):
+            return reply.encode() + b"\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(
+                FakeRedisServer._encode(item if isinstance(item, int) else f"${len(item)}\r\n{item}")
+                for item in reply
+            )
+    
+    async def _handle(self, reader, writer):
+        import asyncio
+        
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._encode(self._command(args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+class TestRedisRateLimiter:
+    """Testes do limitador distribuído contra um servidor RESP falso"""
+    
+    def test_budget_is_shared_between_nodes(self):
+        """Testa que dois nós somados respeitam o burst global com reservas em lote"""
+        import asyncio
+        from rate_limit import RedisRateLimiter
+        
+        async def scenario(url):
+            nodes = [
+                RedisRateLimiter(url, requests_per_minute=1, burst=10, batch_size=3, timeout=1)
+                for _ in range(2)
+            ]
+            allowed = 0
+            for _ in range(15):
+                for node in nodes:
+                    allowed += (await node.acquire("198.51.100.1")).allowed
+            for node in nodes:
+                await node.client.close()
+            return allowed
+        
+        with FakeRedisServer() as server:
+            allowed = asyncio.run(scenario(server.url))
+            assert allowed == 10
+            # Reservas em lote e negativas guardadas: bem menos idas ao Redis que requisições
+            assert server.script_calls <= 6
+    
+    def test_slow_store_falls_back_to_local_limit(self):
+        """Testa que um Redis lento não segura a requisição"""
+        import asyncio
+        from rate_limit import RedisRateLimiter, MemoryRateLimiter
+        
+        async def scenario(url):
+            limiter = RedisRateLimiter(
+                url, requests_per_minute=60, timeout=0.05,
+                fallback=MemoryRateLimiter(requests_per_minute=60, burst=2)
+            )
+            results = [await limiter.acquire("198.51.100.2") for _ in range(3)]
+            await limiter.client.close()
+            return results
+        
+        with FakeRedisServer(delay=0.5) as server:
+            results = asyncio.run(scenario(server.url))
+            assert [r.allowed for r in results] == [True, True, False]
+            # Após a primeira falha o Redis é ignorado durante o cooldown
+            assert server.script_calls <= 1
+
+class TestAPIMiddleware:
+    """Testes do middleware ASGI único"""
+    
+    @staticmethod
+    def build_app(limiter):
+        from fastapi import FastAPI
+        from fastapi.responses import StreamingResponse
+        from middleware import APIMiddleware
+        
+        test_app = FastAPI()
+        
+        @test_app.get("/stream")
+        async def stream():
+            async def chunks():
+                for i in range(3):
+                    yield f"chunk{i}\n".encode()
+            return StreamingResponse(chunks(), media_type="text/plain")
+        
+        test_app.add_middleware(APIMiddleware, limiter=limiter)
+        return test_app
+    
+    def test_streaming_response_passes_through(self):
+        """Testa que respostas em streaming recebem os headers sem serem bufferizadas pelo middleware"""
+        from rate_limit import MemoryRateLimiter
+        
+        with TestClient(self.build_app(MemoryRateLimiter(60))) as c:
+            response = c.get("/stream")
+        assert response.text == "chunk0\nchunk1\nchunk2\n"
+        assert response.headers["X-Frame-Options"] == "DENY"
+        assert response.headers["X-RateLimit-Remaining"] == "59"
+        assert float(response.headers["X-Process-Time"]) >= 0
+    
+    def test_rate_limited_response_has_security_headers(self):
+        """Testa que o 429 também sai com headers de segurança e Retry-After"""
+        from rate_limit import MemoryRateLimiter
+        
+        with TestClient(self.build_app(MemoryRateLimiter(60, burst=1))) as c:
+            c.get("/stream")
+            response = c.get("/stream")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+class TestAccessLog:
+    """Testes do log de acesso estruturado"""
+    
+    def test_one_json_line_per_request(self, tmp_path):
+        """Testa que cada requisição vira uma linha JSON"""
+        import json
+        from access_log import AccessLogger
+        
+        path = tmp_path / "access.log"
+        access_logger = AccessLogger(path=str(path))
+        access_logger.log(1700000000.0, "GET", "/data", 200, 0.0125, "10.0.0.1")
+        access_logger.log(1700000001.0, "POST", "/login", 401, 0.3, "10.0.0.2")
+        access_logger.close()
+        
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["status"] for line in lines] == [200, 401]
+        assert lines[0]["path"] == "/data"
+        assert lines[0]["duration_ms"] == 12.5
+    
+    def test_sampling_by_status(self):
+        """Testa amostragem por classe e por status exato"""
+        import io
+        from access_log import AccessLogger, parse_sample_rates
+        
+        rates = parse_sample_rates("5xx=1, 4xx=1, 2xx=0, 404=0")
+        access_logger = AccessLogger(stream=io.StringIO(), sample_rates=rates)
+        assert access_logger.log(0.0, "GET", "/", 500, 0.1, "c")
+        assert access_logger.log(0.0, "GET", "/", 401, 0.1, "c")
+        assert not access_logger.log(0.0, "GET", "/", 404, 0.1, "c")
+        assert not access_logger.log(0.0, "GET", "/", 200, 0.1, "c")
+        assert access_logger.log(0.0, "GET", "/", 302, 0.1, "c")
+        access_logger.close()
+
 class TestSecurity:
     """Testes de segurança"""
     
@@ -275,6 +1769,14 @@ class TestSecurity:
             # Se não atingiu o limite, pelo menos deve funcionar
             assert response.status_code in [200, 429]
     
+    def test_rate_limit_headers(self, client):
+        """Testa headers de rate limit calculados pelo GCRA"""
+        first = client.get("/health")
+        second = client.get("/health")
+        assert first.headers["X-RateLimit-Limit"] == "60"
+        assert int(first.headers["X-RateLimit-Remaining"]) == 59
+        assert int(second.headers["X-RateLimit-Remaining"]) == 58
+    
     def test_invalid_token(self, client):
         """Testa token inválido"""
         headers = {"Authorization": "Bearer invalid_token"}